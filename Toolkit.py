@@ -2,38 +2,69 @@ import pandas as pd
 from datetime import datetime , timedelta
 import numpy as np
 
-from constants import total_rows_from_source,COLUMNS_TO_DROP_FROM_GOLDEN_SOURCE,OUTPUT_FILE_PATH_TEMPLATE,LOCATION_MAPPING
+from constants import (COLUMNS_TO_DROP_FROM_GOLDEN_SOURCE,OUTPUT_FILE_PATH_TEMPLATE,LOCATION_MAPPING,GOLDEN_SOURCE_VOCABULARY_COLUMNS,
+                       APPLICATION_ENTRANCE_ACTIVITIES,APPLICATION_EXIT_ACTIVITIES,PROCESS_VERSION_CUTOVERS,
+                       GOLDEN_SOURCE_NULL_POLICY)
+from run_context import RunContext
+from helper_functions import (normalize_timestamps, to_vocabulary, normalize_vocabulary, merge_vocabulary, fill_vocabulary,
+                              apply_null_policy)
+
+def segment_applications(keys: np.ndarray, entrance: np.ndarray, exit: np.ndarray) -> tuple:
+    """
+    Numbers the applications of each key in a single ordered scan over the rows.
+
+    The rows of a key must be contiguous and in time order : a new key starts a new segment wherever the key changes.
+    Every entrance (resp. exit) activity opens the next application for the rows that follow it.
+
+    Args:
+        keys: The key of each row (e.g. 'ID' or 'Candidate_key').
+        entrance: 1 for the rows whose activity is an entrance activity (see APPLICATION_ENTRANCE_ACTIVITIES).
+        exit: 1 for the rows whose activity closes the application (see APPLICATION_EXIT_ACTIVITIES).
+
+    Returns:
+        tuple: Three int32 arrays : the number of entrances before each row of its key , 1 + the number of exits before
+        each row of its key , and their difference.
+    """
+    keys = np.asarray(keys)
+    segment_start = np.ones(len(keys), dtype=bool)
+    segment_start[1:] = keys[1:] != keys[:-1]
+
+    # Counts of the rows strictly before each row , over the whole scan , then relative to the start of its segment
+    flags = np.column_stack([entrance, exit]).astype(np.int32)
+    counts_before = np.cumsum(flags, axis=0, dtype=np.int32) - flags
+    segment_offsets = np.maximum.accumulate(np.where(segment_start[:, None], counts_before, 0), axis=0)
+    counts_before -= segment_offsets
+
+    nb_of_appl_entrance = counts_before[:, 0]
+    nb_of_appl_disq = 1 + counts_before[:, 1]
+    return nb_of_appl_entrance, nb_of_appl_disq, nb_of_appl_entrance - nb_of_appl_disq
+
 
 def shared_cleaning(initial_input_df: pd.DataFrame, key: str) -> pd.DataFrame:
     # Check input types
     assert isinstance(initial_input_df, pd.DataFrame), "initial_input_df should be a pandas DataFrame"
     assert isinstance(key, str), "key should be a string"
 
-    # Find rows with the same activity done at the same time by the same candidate
-    same_activity_df_serie = initial_input_df.groupby(key).apply(lambda x: x.duplicated(subset=['Creation time'], keep=False))
-    # Check if same_activity_df_serie is a Series
-    if isinstance(same_activity_df_serie, pd.Series):
-        same_activity_df = same_activity_df_serie.to_frame()
-        # same_activity_df = same_activity_df_serie
-        same_activity_df.reset_index(inplace=True)
-        same_activity_df.rename(columns={0: 'Activity_done_same_time_ID'}, inplace=True)
-        #same_activity_df.to_excel('activity_check.xlsx')
-
-    else:
-        same_activity_df = same_activity_df_serie
-        same_activity_df.reset_index(inplace=True)
-        same_activity_df.columns = ['ID', 'level_1', 'Activity_done_same_time_ID']
-        #same_activity_df.to_excel('activity_check2.xlsx')
-
-    # Merge the result in the main DataFrame
-    input_df = pd.merge(initial_input_df, same_activity_df, left_index=True, right_on='level_1')
-    input_df = input_df.rename(columns={key+'_x': key}).drop(columns=key+'_y')
-    # Assuming 'Creation time' is a datetime column
-    input_df['Creation time'] = pd.to_datetime(input_df['Creation time'])
+    # Assuming 'Creation time' is a datetime column , only converted if it's not already
+    input_df = initial_input_df.copy()
+    input_df['Creation time'] = normalize_timestamps(input_df['Creation time'])
+
+    # Sort by key and time , rows with the same key and time keep their order (stable sort) . The rows of a key are
+    # then contiguous and in time order , which the application counters below rely on
+    input_df = input_df.sort_values(by=[key, 'Creation time'], kind='stable').reset_index(drop=True)
+
+    # Find rows with the same activity done at the same time by the same candidate : the row before or after has the
+    # same key and the same time
+    keys = input_df[key].to_numpy()
+    times = input_df['Creation time'].to_numpy()
+    same_as_previous = (keys[1:] == keys[:-1]) & (times[1:] == times[:-1])
+    same_time = np.zeros(len(input_df), dtype=bool)
+    same_time[1:] |= same_as_previous
+    same_time[:-1] |= same_as_previous
+    input_df['Activity_done_same_time_ID'] = same_time
 
     # if one of the activities is 'Disqualified' or 'Auto-disqualified'. Create 'New_creation_time'add 2 min in "creation time"
-    input_df['new_creation_time'] = input_df.apply(
-        lambda x: x['Creation time'] + timedelta(minutes=2) if (x['Activity_done_same_time_ID'] == 1) else x['Creation time'], axis=1)
+    input_df['new_creation_time'] = input_df['Creation time'] + pd.to_timedelta(np.where(same_time, 2, 0), unit='m')
     
     #input_df['new_creation_time'] = input_df ['Creation time']
 
@@ -52,37 +83,20 @@ def shared_cleaning(initial_input_df: pd.DataFrame, key: str) -> pd.DataFrame:
     input_df['new_creation_time'] = input_df.apply(lambda row: update_new_creation_time(row, input_df), axis=1)"""
     
     # Create a new column called 'Disqualified' that value 1 when the activity is either disqualified or auto-disqualified
-    def ID_is_disqualified(row):
-        if row['New_Activity'] == "auto-disqualified" or row['New_Activity'] == 'disqualified':
-            return 1
-        return 0
-
-    input_df['Disqualified'] = input_df.apply(lambda row: ID_is_disqualified(row), axis=1)
+    input_df['Disqualified'] = input_df['New_Activity'].isin(APPLICATION_EXIT_ACTIVITIES).astype(int)
 
     # ---- Methodology to count the number of applications a candidate has done ---
     # create new column entrance = 1 when activity is apply or sourced or upload to job
-    input_df['entrance'] = input_df['New_Activity'].apply(
-        lambda x: 1 if x in ['applied', 'sourced', 'uploaded to job'] else 0)
-    # group the dataframe by ID
-    cumulative_sum = input_df.groupby(key)['entrance'].apply(lambda x: (x == 1).cumsum())
-
-    # use the 'shift' method to shift the values of 'cumulative_sum' by 1
-    shifted_cumsum = cumulative_sum.groupby(input_df[key]).shift(1)
-    # use the 'fillna' method to replace the NaN values with 0s
-    shifted_cumsum = shifted_cumsum.fillna(0)
-    # assign the values of 'shifted_cumsum' to the 'nb of application' column
-    input_df['Nb_of_appl_entrance'] = shifted_cumsum.values
-
-    # ---- Methodology to count the number of applications a candidate has done ---
-    # group the dataframe by key
-    cumulative_sum = input_df.groupby(key)['Disqualified'].apply(lambda x: (x == 1).cumsum())
-    # use the 'shift' method to shift the values of 'cumulative_sum' by 1
-    shifted_cumsum = cumulative_sum.groupby(input_df[key]).shift(1)
-    # use the 'fillna' method to replace the NaN values with 0s
-    shifted_cumsum = shifted_cumsum.fillna(0)
-    # assign the values of 'shifted_cumsum' to the 'nb of application' column
-    input_df['Nb_of_appl_disq'] = 1 + shifted_cumsum.values
-    input_df['nb_of_app_difference'] = input_df['Nb_of_appl_entrance'] - input_df['Nb_of_appl_disq']
+    input_df['entrance'] = input_df['New_Activity'].isin(APPLICATION_ENTRANCE_ACTIVITIES).astype(int)
+    # A disqualification directly reverted (next row of the same key) does not close the application : the pair stays in
+    # one application , where final_processing drops it
+    is_disqualified = input_df['Disqualified'].to_numpy().astype(bool)
+    reverted_next = np.zeros(len(input_df), dtype=bool)
+    reverted_next[:-1] = (keys[1:] == keys[:-1]) & input_df['New_Activity'].eq('reverted').to_numpy()[1:]
+    application_exit = is_disqualified & ~reverted_next
+    # number the applications of each key , by entrance and by disqualification (the rows are sorted by key and time)
+    input_df['Nb_of_appl_entrance'], input_df['Nb_of_appl_disq'], input_df['nb_of_app_difference'] = \
+        segment_applications(keys, input_df['entrance'].to_numpy(), application_exit)
 
     return input_df
 
@@ -114,49 +128,117 @@ def shared_processing(input_df: pd.DataFrame, key: str) -> pd.DataFrame:
     if key not in input_df.columns:
         raise ValueError(f"Key column {key} does not exist in input dataframe.")
 
-    # Add a new column to the DataFrame to indicate whether the sum of
-    # nb_of_app_difference values in each group is evenly divisible by the number of values in the group
+    # One group index for every per-application feature : group code of each row , computed once
+    group_codes, group_keys = pd.factorize(input_df[key], use_na_sentinel=False)
+    nb_groups = len(group_keys)
+
+    # Add a new column to the DataFrame to indicate whether the sum of Nb_of_appl_disq in each group is evenly divisible
+    # by the sum of nb_of_app_difference ( 'OK' when that sum is 0 )
+    disq_sum = np.bincount(group_codes, weights=input_df['Nb_of_appl_disq'].to_numpy(), minlength=nb_groups)
+    difference_sum = np.bincount(group_codes, weights=input_df['nb_of_app_difference'].to_numpy(), minlength=nb_groups)
+    disqualified_ok = np.ones(nb_groups, dtype=bool)
+    has_difference = difference_sum != 0
+    disqualified_ok[has_difference] = np.mod(disq_sum[has_difference], difference_sum[has_difference]) == 0
+    input_df['ID_disqualified_OK'] = np.where(disqualified_ok, 'OK', 'KO')[group_codes]
+
+    # Calculate number of activities , number of distinct activities performed by each candidate , and number of times
+    # each candidate has performed each activity , from the distinct (key , New_Activity) pairs
+    # (rows without activity are not counted)
+    activity_codes, activities = pd.factorize(input_df['New_Activity'])
+    has_activity = activity_codes >= 0
+    pair_codes = group_codes[has_activity].astype(np.int64) * len(activities) + activity_codes[has_activity]
+    pairs, pair_index, pair_counts = np.unique(pair_codes, return_inverse=True, return_counts=True)
+
+    input_df['ID_Nb_Act'] = np.bincount(group_codes[has_activity], minlength=nb_groups)[group_codes]
+    input_df['ID_Nb_Act_Distinct'] = np.bincount(pairs // len(activities), minlength=nb_groups)[group_codes]
+    replicate_counts = np.zeros(len(input_df), dtype=np.int64)
+    replicate_counts[has_activity] = pair_counts[pair_index]
+    input_df['ID_Nb_Replicate_Act'] = replicate_counts if has_activity.all() else np.where(has_activity, replicate_counts, np.nan)
 
-    def check_disqualification(x):
-        if sum(x['nb_of_app_difference']) != 0:
-            if sum(x['Nb_of_appl_disq']) % sum(x['nb_of_app_difference']) == 0:
-                return 'OK'
-            else:
-                return 'KO'
-        else:
-            return 'OK'
+    # Convert 'new_creation_time' to datetime if it's not already
+    input_df['new_creation_time'] = normalize_timestamps(input_df['new_creation_time'])
+
+    # Create the columns 'ID_last_activity' and 'ID_first_activity' that indicate whether each row represents the last
+    # (resp. first) activity performed by each candidate , based on the max (resp. min) 'new_creation_time' of the group
+    # (rows without time are neither counted nor flagged)
+    has_time = input_df['new_creation_time'].notna().to_numpy()
+    times = input_df['new_creation_time'].to_numpy().view(np.int64)
+    last_times = np.full(nb_groups, np.iinfo(np.int64).min)
+    first_times = np.full(nb_groups, np.iinfo(np.int64).max)
+    np.maximum.at(last_times, group_codes[has_time], times[has_time])
+    np.minimum.at(first_times, group_codes[has_time], times[has_time])
+    input_df['ID_last_activity'] = (has_time & (last_times[group_codes] == times)).astype(int)
+    input_df['ID_first_activity'] = (has_time & (first_times[group_codes] == times)).astype(int)
 
-    # Apply the function to each group and then using the results to set the 'ID_disqualified_OK' value for all rows in each group
-    grouped_results = input_df.groupby(key).apply(check_disqualification)
-    input_df['ID_disqualified_OK'] = input_df[key].map(grouped_results)
+    return input_df
 
-    # Calculate number of activities performed by each candidate (grouped by the specified key column)
-    input_df['ID_Nb_Act'] = input_df.groupby([key])['New_Activity'].transform('count')
 
-    # Calculate number of distinct activities performed by each candidate (grouped by the specified key column)
-    input_df['ID_Nb_Act_Distinct'] = input_df.groupby([key])['New_Activity'].transform('nunique')
 
-    # Calculate number of times each candidate has performed each activity (grouped by both the specified key column and the 'New_Activity' column)
-    input_df['ID_Nb_Replicate_Act'] = input_df.groupby([key, 'New_Activity'])['New_Activity'].transform('count')
+    ######---------------------- Data Cleaning and preliminary processing  -----------------------------------------#####
 
-    # Convert 'new_creation_time' to datetime if it's not already
-    input_df['new_creation_time'] = pd.to_datetime(input_df['new_creation_time'])
+def build_job_dimension(jobs, jobs_dict_df: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Parses each distinct job title once ( e.g. 'Business Research - Research Analyst - Cairo - Core' ).
+
+    Args:
+        jobs: The job titles , with repetitions (e.g. the 'new_Job' column).
+        jobs_dict_df: The jobs dictionary (JOB_TO_KEEP_DICT). When given , the job titles missing from it or not to
+            keep are reported.
 
-    # Create a new column called 'ID_last_activity' that indicates whether each row represents the last activity performed by each candidate (based on the maximum 'new_creation_time' value for each candidate)
-    input_df['ID_last_activity'] = np.where(
-        input_df.groupby(key)['new_creation_time'].transform('max').eq(input_df['new_creation_time']), 1, 0)
+    Returns:
+        pd.DataFrame: One row per distinct 'new_Job' with its 'Department', 'Job Position', 'Location', 'Specificities',
+        'country' and 'Department_ST'.
+    """
+    job_dimension_df = pd.DataFrame({'new_Job': pd.Series(pd.unique(pd.Series(jobs).dropna()), dtype=object)})
 
-    # Create a new column called 'ID_first_activity' that indicates whether each row represents the first activity performed by each candidate (based on the minimum 'new_creation_time' value for each candidate)
-    input_df['ID_first_activity'] = np.where(
-        input_df.groupby(key)['new_creation_time'].transform('min').eq(input_df['new_creation_time']), 1, 0)
+    # Split the 'new_Job' column by '-'
+    job_parts_df = job_dimension_df['new_Job'].str.split('-', n=3, expand=True).reindex(columns=range(4))
+    # Remove leading/trailing whitespace from the 'Department', 'Job Position', 'Location', and 'Specificities' columns
+    for i, col in enumerate(['Department', 'Job Position', 'Location', 'Specificities']):
+        job_dimension_df[col] = job_parts_df[i].str.strip()
+    job_dimension_df['Job Position'] = to_vocabulary(job_dimension_df['Job Position'])
 
-    return input_df
+    # Apply the mapping to create the 'country' column
+    job_dimension_df['country'] = job_dimension_df['Location'].map(LOCATION_MAPPING)
 
+    # Replace all departments linked to service team to 'Service Team'
+    job_dimension_df['Department_ST'] = to_vocabulary(job_dimension_df['Department'].replace(
+        dict.fromkeys(['IT', 'Marketing', 'Finance', 'Office Management','HR','Operations'], 'Service Team')),
+        lowercase=False)
 
+    if jobs_dict_df is not None:
+        known_jobs = jobs_dict_df['Job'].astype(str).str.strip()
+        not_in_dict = ~job_dimension_df['new_Job'].str.strip().isin(known_jobs)
+        not_to_keep = job_dimension_df['new_Job'].str.strip().isin(known_jobs[jobs_dict_df['Job To Keep'] == 0])
+        if not_in_dict.any():
+            print(f"Warning: {not_in_dict.sum()} job titles are not in the jobs dictionary , "
+                  f"e.g. {job_dimension_df.loc[not_in_dict, 'new_Job'].head(3).tolist()}")
+        if not_to_keep.any():
+            print(f"Warning: {not_to_keep.sum()} job titles are marked as not to keep in the jobs dictionary , "
+                  f"e.g. {job_dimension_df.loc[not_to_keep, 'new_Job'].head(3).tolist()}")
 
-    ######---------------------- Data Cleaning and preliminary processing  -----------------------------------------#####
+    return job_dimension_df
+
+
+def reverted_pair_mask(df: pd.DataFrame, key: str = 'unique_ID') -> np.ndarray:
+    """
+    Returns the mask of the rows of a "disqualified" activity directly followed by a "reverted" one , and of those
+    "reverted" rows. The rows must be sorted by `key` and time : a pair never spans two keys. A reverted
+    disqualification does not close its application (see shared_cleaning) , so both rows of a pair share a unique_ID.
+    """
+    keys = df[key].to_numpy()
+    is_reverted = df['New_Activity'].eq('reverted').to_numpy()
+    is_disqualified = df['New_Activity'].isin(['disqualified', 'auto_disqualified']).to_numpy()
+
+    # Pair (i , i+1) : same key , disqualified then reverted
+    pair_starts = (keys[1:] == keys[:-1]) & is_disqualified[:-1] & is_reverted[1:]
+    mask = np.zeros(len(df), dtype=bool)
+    mask[:-1] |= pair_starts
+    mask[1:] |= pair_starts
+    return mask
 
-def final_processing(concatenated_df: pd.DataFrame) -> pd.DataFrame:
+
+def final_processing(concatenated_df: pd.DataFrame, run_context: RunContext) -> pd.DataFrame:
 
     # Check input type
     print("########## Final Processing Stage #########")
@@ -170,20 +252,13 @@ def final_processing(concatenated_df: pd.DataFrame) -> pd.DataFrame:
         raise ValueError("Input dataframe is empty.")
 
     total_rows_without_reffered_a_candidate = len(concatenated_df)
-    # Split the 'new_Job' column by '-'
-    concatenated_df[['Department', 'Job Position', 'Location', 'Specificities']] = concatenated_df['new_Job'].str.split('-', n=3, expand=True)
-    # Remove leading/trailing whitespace from the 'Department', 'Job Position', 'Location', and 'Specificities' columns
-    concatenated_df['Department'] = concatenated_df['Department'].str.strip()
-    concatenated_df['Job Position'] = concatenated_df['Job Position'].str.strip()
-    concatenated_df['Location'] = concatenated_df['Location'].str.strip()
-    concatenated_df['Specificities'] = concatenated_df['Specificities'].str.strip()
-
-    # Apply the mapping to create the 'country' column
-    concatenated_df['country'] = concatenated_df['Location'].map(LOCATION_MAPPING)
-
-    # Replace all departments linked to service team to 'Service Team'
-    concatenated_df['Department_ST'] = concatenated_df['Department'].replace(
-        dict.fromkeys(['IT', 'Marketing', 'Finance', 'Office Management','HR','Operations'], 'Service Team'))
+    # Parse the distinct job titles once ('Department', 'Job Position', 'Location', 'Specificities', 'country' and
+    # 'Department_ST') and merge them back on 'new_Job'
+    job_dimension_df = build_job_dimension(concatenated_df['new_Job'], run_context.jobs_dict_df)
+    concatenated_df = pd.merge(concatenated_df, job_dimension_df, on='new_Job', how='left')
+    # The branches may have rewritten different activities (e.g. 'applied with moved to job position') , align
+    # 'New_Activity' on one set of categories
+    concatenated_df['New_Activity'] = to_vocabulary(concatenated_df['New_Activity'])
 
 
     # Keep the latest of rollup activity
@@ -211,15 +286,16 @@ def final_processing(concatenated_df: pd.DataFrame) -> pd.DataFrame:
     concatenated_df = concatenated_df.groupby('unique_ID')[~mask]
     )"""
 
-    # Function to filter the dataframe based on the consecutive "reverted" and "disqualified" values
-    def filter_df(group):
-        mask1 = (group['New_Activity'] == 'reverted') & (group['New_Activity'].shift(1).isin(['disqualified','auto_disqualified']) )
-        mask2 = (group['New_Activity'].isin(['disqualified','auto_disqualified'])) & (group['New_Activity'].shift(-1) == 'reverted')
-        combined_mask = mask1 | mask2
-        return group[~combined_mask]
+    # Drop the consecutive "disqualified" and "reverted" activities of each unique_ID (the rows are sorted by unique_ID
+    # and new_creation_time) , and report the number of pairs dropped per department
+    reverted_mask = reverted_pair_mask(concatenated_df)
+    reverted_pairs = concatenated_df.loc[reverted_mask & (concatenated_df['New_Activity'] == 'reverted').to_numpy(),
+                                         'Department_ST'].value_counts()
+    reverted_pairs = reverted_pairs[reverted_pairs > 0].to_dict()
+    run_context.stage_metrics['reverted_pairs'] = reverted_pairs
+    print(f"- Disqualified / reverted pairs dropped : {sum(reverted_pairs.values())} {reverted_pairs}")
 
-    # Group by unique_ID and apply the filtering function
-    concatenated_df = concatenated_df.groupby('unique_ID').apply(filter_df)
+    concatenated_df = concatenated_df[~reverted_mask]
     # Reset the index and drop the old index column
     concatenated_df.reset_index(drop=True, inplace=True)
     #concatenated_df.to_excel("Check_after_drop_reverted.xlsx")
@@ -227,17 +303,116 @@ def final_processing(concatenated_df: pd.DataFrame) -> pd.DataFrame:
 
     return concatenated_df
 
-def process_step_stage(unified_df: pd.DataFrame, process_step_df: pd.DataFrame , targets_df: pd.DataFrame , is_senior_df : pd.DataFrame ) -> pd.DataFrame:
+def add_version_cutover_flags(df: pd.DataFrame, cutovers: list = PROCESS_VERSION_CUTOVERS):
+    """
+    Adds one 0/1 column per process version cutover (see PROCESS_VERSION_CUTOVERS) : 1 on every row of the
+    applications (unique_ID) whose first activity in the cutover's department is after the cutover date.
+    """
+    department = df['Department_ST'].str.lower()
+    for cutover in cutovers:
+        in_department = department == cutover['Department_ST'].lower()
+        first_activity_time = df['new_creation_time'].where(in_department).groupby(df['unique_ID']).transform('min')
+        df[cutover['flag']] = (first_activity_time > pd.Timestamp(cutover['cutover'])).astype(int)
+
+
+def add_elapsed_since_anchor(df: pd.DataFrame, anchor_specs: list, elapsed_col: str = 'cummulative_time_diff_in_days'):
+    """
+    Adds , for each (anchor Process_Step , eligibility mask , output column) spec , the elapsed time of every row since
+    the first eligible anchor step of its application (unique_ID) : `elapsed_col` minus its value at the anchor ,
+    negative differences and applications without an eligible anchor are set to 0.
+
+    Args:
+        df (pd.DataFrame): The golden source , in application and time order.
+        anchor_specs (list): (anchor Process_Step , boolean Series aligned on df , output column name) tuples.
+        elapsed_col (str): The cumulative time column the differences are taken on.
+    """
+    for anchor_step, eligible, output_col in anchor_specs:
+        is_anchor = (df['Process_Step'] == anchor_step) & eligible
+        # Value of the first anchor row of each application , NaN when it has none
+        anchor_value = df[elapsed_col].where(is_anchor).groupby(df['unique_ID']).transform('first')
+        df[output_col] = (df[elapsed_col] - anchor_value).clip(lower=0).fillna(0)
+
+
+def add_applied_rows(df: pd.DataFrame) -> tuple:
+    """
+    Makes every application (unique_ID) start with an 'applied' step 5 minutes before its first row : the
+    'new_creation_time' of its existing 'applied' rows is moved there , or a copy of its first row is inserted there
+    with 'applied' as Process_Step.
+
+    Args:
+        df (pd.DataFrame): The golden source , in application and time order.
+
+    Returns:
+        tuple: The DataFrame in application order with a fresh index (synthetic rows first in their application) , and
+        the number of synthetic rows added.
+    """
+    is_first = ~df['unique_ID'].duplicated()
+    is_applied = df['Process_Step'] == 'applied'
+    has_applied = is_applied.groupby(df['unique_ID']).transform('any')
+    # Time of the first row of each application , minus 5 minutes
+    applied_time = df['new_creation_time'].where(is_first).groupby(df['unique_ID']).transform('max') \
+        - pd.Timedelta(minutes=5)
+
+    df = df.copy()
+    df.loc[is_applied, 'new_creation_time'] = applied_time[is_applied]
+
+    synthetic_df = df.loc[is_first & ~has_applied].copy()
+    synthetic_df['Process_Step'] = 'applied'
+    synthetic_df['new_creation_time'] = applied_time[synthetic_df.index]
+
+    df = pd.concat([synthetic_df, df]).sort_values(by='unique_ID', kind='stable').reset_index(drop=True)
+    return df, len(synthetic_df)
+
+
+def build_application_summary(golden_source_df: pd.DataFrame, applications_with_duplicated_steps) -> pd.DataFrame:
+    """
+    Builds the application dimension : one row per unique_ID , aggregated in a single groupby over the golden source.
+
+    Args:
+        golden_source_df (pd.DataFrame): The golden source , in application and time order , with 'Stage_advancement'.
+        applications_with_duplicated_steps: The unique_IDs whose duplicated process steps were collapsed.
 
-    # format the New_activity Column for further processing
-    is_senior_df['Job Position'] = is_senior_df['Job Position'].str.lower().str.strip()
-    # format the New_activity Column for further processing
-    unified_df['Job Position'] = unified_df['Job Position'].str.lower().str.strip()
-    unified_df = pd.merge(unified_df, is_senior_df, on=['Job Position'], how='left')
+    Returns:
+        pd.DataFrame: Indexed by unique_ID , with 'ID_in_pipeline' , 'ID_is_hired' , 'ID_is_out_of_process' ,
+        'id_hiring_date' (time of the last 'hired' step) , 'Year_process_started' , 'Hired_To_Out_Of_Process_Flag'
+        and 'process_has_duplicates'.
+    """
+    process_step = golden_source_df['Process_Step']
+    summary_df = pd.DataFrame({
+        'unique_ID': golden_source_df['unique_ID'],
+        'last_step': process_step.astype(object),
+        'id_hiring_date': golden_source_df['new_creation_time'].where(process_step == 'hired'),
+        'process_started': golden_source_df['new_creation_time'],
+        'Hired_To_Out_Of_Process_Flag': golden_source_df['Stage_advancement'] == 'hired ==> out of process',
+    }).groupby('unique_ID').agg(last_step=('last_step', 'last'),
+                                id_hiring_date=('id_hiring_date', 'last'),
+                                process_started=('process_started', 'min'),
+                                Hired_To_Out_Of_Process_Flag=('Hired_To_Out_Of_Process_Flag', 'max'))
+
+    last_step = summary_df.pop('last_step')
+    summary_df['ID_in_pipeline'] = (~last_step.isin(['out of process', 'hired'])).astype(int)
+    summary_df['ID_is_hired'] = (last_step == 'hired').astype(int)
+    summary_df['ID_is_out_of_process'] = (last_step == 'out of process').astype(int)
+    summary_df['Year_process_started'] = summary_df.pop('process_started').dt.year
+    summary_df['Hired_To_Out_Of_Process_Flag'] = summary_df['Hired_To_Out_Of_Process_Flag'].astype(int)
+    summary_df['process_has_duplicates'] = summary_df.index.isin(applications_with_duplicated_steps).astype(int)
+    return summary_df[['ID_in_pipeline', 'ID_is_hired', 'ID_is_out_of_process', 'id_hiring_date',
+                       'Year_process_started', 'Hired_To_Out_Of_Process_Flag', 'process_has_duplicates']]
+
+
+def process_step_stage(unified_df: pd.DataFrame, run_context: RunContext) -> pd.DataFrame:
+
+    process_step_df = run_context.process_step_df
+    targets_df = run_context.targets_df
+    is_senior_df = run_context.is_senior_df
+    total_rows_from_source = run_context.total_rows_from_source
+
+    # The text columns of the dictionaries are already normalised (see VOCABULARY_COLUMNS) , 'Job Position' is only
+    # normalised here if final_processing did not already do it
+    unified_df['Job Position'] = to_vocabulary(unified_df['Job Position'])
+    unified_df = merge_vocabulary(unified_df, is_senior_df, on=['Job Position'], how='left')
     unified_df['is_senior'].fillna(1,inplace=True)
 
-    # format the New_activity Column for further processing
-    process_step_df['New_Activity'] = process_step_df['New_Activity'].str.lower().str.strip()
     total_rows_before_process_step = len(unified_df)
     # Create a dictionary mapping New_Activity values to Process_Step values
     total_rows_after_keep_roll_up = len(unified_df)
@@ -283,7 +458,7 @@ def process_step_stage(unified_df: pd.DataFrame, process_step_df: pd.DataFrame ,
 
     # Define a function to check if the first date in a group is after July 2023
 
-    golden_source_df['new_creation_time'] = pd.to_datetime(golden_source_df['new_creation_time'], errors='coerce')
+    golden_source_df['new_creation_time'] = normalize_timestamps(golden_source_df['new_creation_time'])
     print('- Set the cuttoff date to 01-01-2022 for archived jobs ( e.g 01-01-1970 ---> 01-01-2022)')
     # Define a cutoff date
     cutoff_date = pd.Timestamp('2022-01-01')
@@ -291,33 +466,29 @@ def process_step_stage(unified_df: pd.DataFrame, process_step_df: pd.DataFrame ,
     # Replace dates earlier than the cutoff date
     golden_source_df.loc[golden_source_df['new_creation_time'] < cutoff_date, 'new_creation_time'] = cutoff_date
 
-    golden_source_df.fillna('', inplace=True)
+    # '' for the nulls of the text columns only , the numeric and datetime columns keep their dtype
+    golden_source_df = apply_null_policy(golden_source_df, GOLDEN_SOURCE_NULL_POLICY)
     # Create a new column 'is_BR' based on the 'Department_ST' column
-    golden_source_df['is_BR'] = golden_source_df['Department_ST'].apply(
-        lambda x: 1 if isinstance(x, str) and x.lower() == 'business research' else 0)
+    golden_source_df['is_BR'] = (golden_source_df['Department_ST'].str.lower() == 'business research').astype(int)
 
     # Create a new column 'is_BR' based on the 'Department_ST' column
     #golden_source_df['is_BR'] = golden_source_df['Department_ST'].apply(
         #lambda x: 1 if x.lower() == 'business research' else 0)
 
-    # Group by 'unique_ID' for rows where 'is_BR' is 1
-    br_groups = golden_source_df[golden_source_df['is_BR'] == 1].groupby('unique_ID')
-
-    #initialize golden_source_df['BR_updated_in_july_2023'] with 0
-    golden_source_df['BR_updated_in_july_2023']=0
-    # Check if the minimum 'new_creation_time' is greater than '2023-07-01'
-    for unique_id, group_df in br_groups:
-        if group_df['new_creation_time'].min() > pd.Timestamp('2023-07-01'):
-            # Step 4: Assign 1 to the 'BR_updated_in_jan_2023' column for all rows within the group
-            golden_source_df.loc[golden_source_df['unique_ID'] == unique_id, 'BR_updated_in_july_2023'] = 1
-
-    # Fill any NaN values in the new column with 0
-    golden_source_df['BR_updated_in_july_2023'].fillna(0, inplace=True)
+    # Flag the applications following a new version of their department's process (e.g. 'BR_updated_in_july_2023') :
+    # the minimum 'new_creation_time' of the application's rows in the department is after the cutover date
+    add_version_cutover_flags(golden_source_df)
     #golden_source_df.to_excel('check_before_proc_step.xlsx')
 
-    golden_source_df = pd.merge(golden_source_df, process_step_df, on=['Department_ST', 'is_BR', 'BR_updated_in_july_2023' ,'New_Activity'], how='left')
+    # Every cutover flag is a key of the process step dictionary , the version of the process is matched on all of them
+    version_flags = [cutover['flag'] for cutover in PROCESS_VERSION_CUTOVERS]
+    missing_flags = [flag for flag in version_flags if flag not in process_step_df.columns]
+    if missing_flags:
+        raise ValueError(f"the process step dictionary has no column for the version cutovers {missing_flags}")
+    golden_source_df = merge_vocabulary(golden_source_df, process_step_df,
+                                        on=['Department_ST', 'is_BR'] + version_flags + ['New_Activity'], how='left')
     # Fill any null values in the "Process Step" column with an empty string
-    golden_source_df['Process_Step'].fillna('', inplace=True)
+    golden_source_df['Process_Step'] = fill_vocabulary(golden_source_df['Process_Step'], '')
     row_after_process_mapping=len(golden_source_df)
     # Report the results
     print(
@@ -343,44 +514,13 @@ def process_step_stage(unified_df: pd.DataFrame, process_step_df: pd.DataFrame ,
         f"- Total rows dropped/added in this step: {total_rows_without_process_blank - total_rows_from_source}")
     print(f'- Total rows before adding applied :{len(golden_source_df)}')
 
-
-
-    # Define a function to apply to each group (i.e., to each unique `unique_ID`)
-    """def add_applied_if_not_present(df):
-        # If the first `Process_Step` in the group is not 'Applied',
-        # create a new row, alter the `Process_Step` and `new_creation_time` as needed,
-        # and add the new row to the group.
-        if 'applied' in grouped_df:
-
-        if df.iloc[0]['Process_Step'].str.strip().str.lower() != 'applied':
-            first_row = df.iloc[0].copy()
-            first_row['Process_Step'] = 'Applied'
-            first_row['new_creation_time'] -= pd.Timedelta(minutes=5)
-            df = pd.concat([pd.DataFrame(first_row).T, df])
-        return df"""
-
-    def add_applied_if_not_present(df):
-        # Check if the group contains 'applied' in any row
-        if 'applied' in df['Process_Step'].str.strip().str.lower().values:
-            first_row = df.iloc[0]
-            applied_indices = df[df['Process_Step'].str.strip().str.lower() == 'applied'].index
-            df.loc[applied_indices, 'new_creation_time'] = first_row['new_creation_time'] - pd.Timedelta(minutes=5)
-        else:
-            # If the first `Process_Step` in the group is not 'Applied',
-            # create a new row, alter the `Process_Step` and `new_creation_time` as needed,
-            # and add the new row to the group.
-            if df.iloc[0]['Process_Step'].strip().lower() != 'applied':
-                first_row = df.iloc[0].copy()
-                first_row['Process_Step'] = 'Applied'
-                first_row['new_creation_time'] -= pd.Timedelta(minutes=5)
-                df = pd.concat([first_row.to_frame().T, df])
-        return df
-
-
-    grouped_df = golden_source_df.groupby('unique_ID')
-    # Apply the function to each group and combine the results into a single DataFrame
-    golden_source_df = grouped_df.apply(add_applied_if_not_present)
-    golden_source_df.reset_index(drop=True, inplace=True)
+    # Give every application an 'applied' step 5 minutes before its first activity : the existing 'applied' rows are
+    # moved there , the applications without one get a synthetic row
+    golden_source_df, total_rows_synthesised = add_applied_rows(golden_source_df)
+    print(f'- Synthetic applied rows added : {total_rows_synthesised}')
+    run_context.stage_metrics['synthetic_applied_rows'] = total_rows_synthesised
+    # The synthetic rows are plain objects , put the text columns back into categoricals
+    golden_source_df = normalize_vocabulary(golden_source_df, GOLDEN_SOURCE_VOCABULARY_COLUMNS)
     # Recalculate the total number of rows in the modified DataFrame
     total_rows_after_adding_applied_if_applicable = len(golden_source_df)
     #print(f'Total rows after adding applied if applicable  :{total_rows_after_adding_applied_if_applicable}')
@@ -399,12 +539,13 @@ def process_step_stage(unified_df: pd.DataFrame, process_step_df: pd.DataFrame ,
     #print(len(golden_source_df_empty_process))
     #golden_source_df_empty_process.to_excel(r".\temp\golden_source_df_without_process.xlsx",index=False)
 
-    golden_source_df = golden_source_df.sort_values(by=['unique_ID', 'new_creation_time'])
-    # Drop duplicates based on all columns except 'new_creation_time' and keep the last occurrence ( This part is commented out for now)
-    golden_source_df = golden_source_df.sort_values(by='new_creation_time', ascending=True) \
-        .groupby('unique_ID') \
-        .apply(lambda x: x.drop_duplicates(subset='Process_Step', keep='last')) \
-        .reset_index(drop=True)
+    # Keep the last occurrence of each process step of an application , in application and time order , and note the
+    # applications that had duplicated steps (see 'process_has_duplicates'). Steps done at the same time are ordered by
+    # their original 'Creation time' , then keep the order of the rows
+    golden_source_df = golden_source_df.sort_values(by=['unique_ID', 'new_creation_time', 'Creation time'], kind='stable')
+    duplicated_step = golden_source_df.duplicated(subset=['unique_ID', 'Process_Step'], keep='last')
+    applications_with_duplicated_steps = golden_source_df.loc[duplicated_step, 'unique_ID'].unique()
+    golden_source_df = golden_source_df[~duplicated_step].reset_index(drop=True)
 
 
     """golden_source_df['Keep_last_Process'] = golden_source_df.groupby(
@@ -454,7 +595,7 @@ def process_step_stage(unified_df: pd.DataFrame, process_step_df: pd.DataFrame ,
     # Define conditions for the 'autotest_subset_vanilla' column based on specified criteria for each unique_ID
     conditions = (golden_source_df['Specificities'].str.lower() == 'core') & \
                  (golden_source_df['Department_ST'].str.lower() == 'business research') & \
-                 (golden_source_df['Job Position'].str.lower().isin(['research analyst',
+                 (golden_source_df['Job Position'].isin(['research analyst',
                                                                      'senior research analyst',
                                                                      'research associate']))
 
@@ -468,38 +609,14 @@ def process_step_stage(unified_df: pd.DataFrame, process_step_df: pd.DataFrame ,
     golden_source_df['id_not_vanilla'] = golden_source_df['unique_ID'].isin(
         golden_source_df.loc[id_hr_interview_mask, 'unique_ID']).astype(int)
 
-    # Subtract 'auto_test_times' from 'time_diff_in_days' where 'id_is_vanilla' is 1, else 0. Set to 0 if the difference is negative.
-    # Assuming your DataFrame is named 'golden_source_df'
-    def subtract_auto_test(row):
-        auto_test_rows = golden_source_df[(golden_source_df['unique_ID'] == row['unique_ID']) & (
-                    golden_source_df['Process_Step'] == 'Automated test')
-                    & (golden_source_df['id_is_vanilla']  == 1)]
-        if len(auto_test_rows) > 0:
-            result = row['cummulative_time_diff_in_days'] - auto_test_rows['cummulative_time_diff_in_days'].iloc[0]
-            return max(result, 0)  # Replace negative values with 0
-        else:
-            return 0
-
     # Reset the index to the default integer index and drop the previous index
     golden_source_df = golden_source_df.reset_index(drop=True)
-    print('- Calculate time diffrence from autotest for vanilla Ids : ')
-    golden_source_df['Cum_Time_diff_from_autotest'] = golden_source_df.apply(subtract_auto_test, axis=1)
-
-
-    def subtract_hr_interview(row):
-        auto_test_rows = golden_source_df[(golden_source_df['unique_ID'] == row['unique_ID']) & (
-                golden_source_df['Process_Step'] == 'HR Interview')
-
-                & (golden_source_df['id_is_vanilla']  == 0 )]
-
-        if len(auto_test_rows) > 0:
-            result = row['cummulative_time_diff_in_days'] - auto_test_rows['cummulative_time_diff_in_days'].iloc[0]
-            return max(result, 0)  # Replace negative values with 0
-        else:
-            return 0
-
-    print('- Calculate time diffrence from HR interview for Non-vanilla Ids : ')
-    golden_source_df['Cum_Time_diff_from_HR_Interview'] = golden_source_df.apply(subtract_hr_interview, axis=1)
+    # Cumulative time from the automated test for the vanilla Ids , and from the HR interview for the others
+    print('- Calculate time diffrence from autotest for vanilla Ids and from HR interview for Non-vanilla Ids : ')
+    add_elapsed_since_anchor(golden_source_df, [
+        ('automated test', golden_source_df['id_is_vanilla'] == 1, 'Cum_Time_diff_from_autotest'),
+        ('hr interview', golden_source_df['id_is_vanilla'] == 0, 'Cum_Time_diff_from_HR_Interview'),
+    ])
 
 
     # Initialize the 'autotest_subset_vanilla' column with 0
@@ -509,8 +626,8 @@ def process_step_stage(unified_df: pd.DataFrame, process_step_df: pd.DataFrame ,
     golden_source_df['hr_interview_subset'] = 0
 
     # Create a boolean mask based on the conditions
-    vanilla_mask = golden_source_df['Process_Step'].eq('Offer') & conditions
-    hr_interview_mask = golden_source_df['Process_Step'].eq('Offer') & ~conditions
+    vanilla_mask = golden_source_df['Process_Step'].eq('offer') & conditions
+    hr_interview_mask = golden_source_df['Process_Step'].eq('offer') & ~conditions
 
     # Set the value of 'autotest_subset_vanilla' to 1 for rows that meet the conditions and have 'Process_Step' equal to 'Offer'
     golden_source_df.loc[vanilla_mask, 'autotest_subset_vanilla'] = 1
@@ -523,44 +640,19 @@ def process_step_stage(unified_df: pd.DataFrame, process_step_df: pd.DataFrame ,
     # Add a new column to show the previous process step for each application
     golden_source_df['previous_process_step'] = golden_source_df.groupby('unique_ID')['Process_Step'].shift(1)
 
-    # Add a new column to show whether each application is still in pipeline
-    golden_source_df['ID_in_pipeline'] = golden_source_df.groupby('unique_ID')['Process_Step'].transform(
-        lambda x: int(x.iloc[-1] not in ['Out of Process', 'Hired']))
-
-    # Add a new column to show whether each application has been hired
-    golden_source_df['ID_is_hired'] = golden_source_df.groupby('unique_ID')['Process_Step'].transform(
-        lambda x: int(x.iloc[-1] == 'Hired'))
-
-    # Create a dictionary mapping 'unique_ID' to the last occurrence of 'new_creation_time' for rows where 'Process_Step' is 'Hired'
-    hiring_dates_mapping = golden_source_df.loc[golden_source_df['Process_Step'] == 'Hired'].groupby('unique_ID')[
-        'new_creation_time'].last().to_dict()
-
-    # Add the 'id_hiring_date' column to 'golden_source_df' using the mapping
-    golden_source_df['id_hiring_date'] = golden_source_df['unique_ID'].map(hiring_dates_mapping)
-
-    # Add a new column to show whether each application is out of process
-    golden_source_df['ID_is_out_of_process'] = golden_source_df.groupby('unique_ID')['Process_Step'].transform(
-        lambda x: int(x.iloc[-1] == 'Out of Process'))
-
     # Create a new column named "Stage_advancement" in the DataFrame that concatenates the "Process_Step" column with the "previous_process_step" column
-    golden_source_df['Stage_advancement'] = golden_source_df['previous_process_step'].fillna('') + ' ==> ' + \
-                                            golden_source_df['Process_Step']
-
-    # Group the DataFrame by 'unique_ID' and find the minimum 'new_creation_time' for each group
-    min_creation_time_per_id = golden_source_df.groupby('unique_ID')['new_creation_time'].min()
-
-    # Extract the year from the minimum creation time for each group and map it back to the DataFrame
-    golden_source_df['Year_process_started'] = golden_source_df['unique_ID'].map(min_creation_time_per_id.dt.year)
-    targets_df['Stage_advancement'] = targets_df['Stage_advancement'].str.lower().str.strip()
-    golden_source_df['Stage_advancement']=golden_source_df['Stage_advancement'].str.lower().str.strip()
-    golden_source_df = pd.merge(golden_source_df, targets_df, on=['Department_ST', 'is_senior','Stage_advancement','Year_process_started'], how='left')
-
-    # Add a flag for the stage advancement
-    golden_source_df['Hired_To_Out_Of_Process_Flag'] = golden_source_df.groupby('unique_ID')[
-        'Stage_advancement'].transform(lambda x: 1 if any(y.lower() == 'hired ==> out of process' for y in x) else 0)
-
-    golden_source_df['process_has_duplicates'] = golden_source_df.groupby('unique_ID') \
-        ['Process_Step'].transform(lambda x: 1 if x.duplicated().any() else 0)
+    golden_source_df['Stage_advancement'] = to_vocabulary(
+        golden_source_df['previous_process_step'].astype(object).fillna('') + ' ==> ' +
+        golden_source_df['Process_Step'].astype(object))
+
+    # One row per application (in pipeline , hired , out of process , hiring date , ...) , exported as its own table
+    application_summary_df = build_application_summary(golden_source_df, applications_with_duplicated_steps)
+    run_context.application_summary_df = application_summary_df
+
+    # The targets are set per year the process started : the only summary column the activity rows need
+    golden_source_df['Year_process_started'] = golden_source_df['unique_ID'].map(
+        application_summary_df['Year_process_started'])
+    golden_source_df = merge_vocabulary(golden_source_df, targets_df, on=['Department_ST', 'is_senior','Stage_advancement','Year_process_started'], how='left')
 
 
     print('- Drop duplicates on the process step column for each unique_ID (Only keep the last one) ')
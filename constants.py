@@ -1,6 +1,6 @@
-from helper_functions import read_file
-
 # constants.py
+import os
+
 LOCATION_MAPPING = {
     'Barcelona': 'Spain',
     'Casablanca': 'Morocco',
@@ -13,14 +13,31 @@ LOCATION_MAPPING = {
 
 # Column names for activity_report
 ACTIVITY_REPORT_COLS = ['Name', 'Activity', 'Candidate', 'Job', 'Creation time']
+# Columns of the activity report loaded as categoricals , and the memory allowed per parsed chunk of a CSV export
+ACTIVITY_REPORT_CATEGORY_COLS = ['Name', 'Activity', 'Job']
+ACTIVITY_REPORT_MEMORY_BUDGET_MB = 64
+ACTIVITY_REPORT_SAMPLE_ROWS = 1000
 ACTIVITY_DICTIONARY_COLS = ['Activity', 'New_Activity', 'Act_Is_Step', 'Explanation']
 HR_NAMES_COLS = ['Name','Name_Is_HRTeam']
 PROCESS_STEP_COLS =['Process_Step','Department_ST','New_Activity']
 TARGETS_COLS =['Department_ST','Stage_advancement','Target Name','Target Value in nb of days']
 
 
+# Rewrite rules applied in order to the distinct activities of the report , once merged with the activity dictionary.
+# match : column tested ('Activity' or 'New_Activity') , contains / equals : lowercase pattern the value is tested against ,
+# New_Activity / Act_Is_Step : values written for the matching activities , flag : 0/1 column set to 1 for them
+ACTIVITY_REWRITE_RULES = [
+    {'match': 'Activity', 'contains': 'moved to job', 'New_Activity': 'moved to job position', 'Act_Is_Step': 1},
+    {'match': 'Activity', 'contains': 'copied to job', 'New_Activity': 'moved to job position', 'Act_Is_Step': 1},
+    {'match': 'New_Activity', 'equals': 'woken up', 'New_Activity': 'unsnoozed'},
+    {'match': 'New_Activity', 'equals': 'referred a candidate', 'flag': 'act_is_referred'},
+]
+
+
 # File paths for input data and output file
 #ACTIVITY_REPORT_PATH = r".\input_data\Copy of ActivityReport_0101202210312023_JobOK_Cleaned_ALL.xlsx"
+# The activity report can also be a glob or a list of overlapping exports , e.g. a full range export plus monthly deltas
+# [r".\input_data\activity_report_2022-01-01_2023-11-30_lines_deleted (1).csv", r".\input_data\activity_report_2023-12-*.csv"]
 ACTIVITY_REPORT_PATH = r".\input_data\activity_report_2022-01-01_2023-11-30_lines_deleted (1).csv"
 ACTIVITY_DICT_PATH = r".\input_data\InputDE_RecrDB_ActivityDictionnary_08312023.xlsx"
 HR_NAMES_PATH = r".\input_data\InputDE_RecrDB_HRRecruitmentTeamDictionnary_09152023.xlsx"
@@ -32,6 +49,13 @@ OFFER_REJECTION_PATH =r'.\input_data\20230712_Offer rejection Reasons.xlsx'
 RECRUITERS_PATH=r'.\input_data\InputDE_RecrDB_JobsRecruitersDictionnary_09152023 - NG.xlsx'
 JOB_TO_KEEP_DICT=r'.\input_data\InputDE_RecrDB_JobsDictionnary_09192023.xlsx'
 
+# Parquet cache of the CSV / Excel inputs , kept next to input_data
+CACHE_DIR_PATH = os.path.join('.', 'input_cache')
+CACHEABLE_EXTENSIONS = ['.csv', '.xlsx', '.xls']
+
+# Outputs of the pipeline stages , keyed by a hash of the code and of the inputs they depend on (see stages.py)
+CHECKPOINT_DIR_PATH = os.path.join('.', 'checkpoints')
+
 # Output file
 OUTPUT_FILE_PATH_TEMPLATE = ".\\output_data\\golden_source_before_ranking_proc_df_{}.xlsx"
 # LOG FILES for Console LOG
@@ -40,34 +64,72 @@ OUTPUT_LOG_FILE_PATH = '.\\output_data\\console_log.docx'  # Output Word documen
 
 # Error messages for file not found exceptions
 ERROR_ACTIVITY_REPORT_NOT_FOUND = "Error: activity_report file not found"
+ERROR_ACTIVITY_REPORT_INVALID = "Error: activity_report {} failed validation (chunk: {})"
+ERROR_NO_ACTIVITY_EVENT_EXPORT = "Error: no activity event export among {}"
+WARNING_ACTIVITY_REPORT_NOT_EVENTS = "Warning: {} skipped , it is not an activity event export (missing columns: {})"
 ERROR_ACTIVITY_DICT_NOT_FOUND = "Error: activity dictionary file not found"
 ERROR_HR_NAMES_NOT_FOUND = "Error: HR name list file not found"
 ERROR_PROCESS_STEP_NOT_FOUND = "Error: process step file not found"
 ERROR_RANKING_DICT_NOT_FOUND = "Error: ranking dictionary file not found"
+WARNING_JOBS_DICT_NOT_FOUND = "Warning: jobs dictionary file not found , the job titles will not be validated"
 ERROR_TARGETS_FILE_NOT_FOUND = "Error: targets file not found"
 
 # Error messages for various processing failures
 ERROR_PRELIMINARY_PROCESSING_FAILED = "Error: preliminary_processing failed with message: {}"
 ERROR_SUB_DATAFRAME_CREATION_FAILED = "Error: sub dataframe creation failed with message: {}"
 ERROR_RANKING_PROCESSOR_FAILED = "Error: ranking processor failed with message: {}"
+ERROR_PROCESS_STEP_STAGE_FAILED = "Error: process step stage failed with message: {}"
+ERROR_EXPORT_FAILED = "Error: export failed with message: {}"
+ERROR_CHECKPOINT_NOT_FOUND = "Error: no checkpoint of the {} stage for the current inputs , run the pipeline from an earlier stage"
 
 # Messages for comments in the output file
 ACTIONS_NOT_IN_RIGHT_ORDER = "Actions not in the right order"
 OK_MESSAGE = "OK"
 
-#Total rows from source
-
 # List of possible date/time formats
 DATE_FORMATS = ["%m/%d/%Y %I:%M:%S %p", "%Y-%m-%d %H:%M:%S", "%m/%d/%y %I:%M:%S %p"]
+# Number of distinct timestamps sampled to rank DATE_FORMATS before parsing a column
+TIMESTAMP_SAMPLE_SIZE = 500
 
 
+# Activities opening an application (entrance) and closing it (exit) , used to number the applications of a candidate
+APPLICATION_ENTRANCE_ACTIVITIES = ['applied', 'sourced', 'uploaded to job']
+APPLICATION_EXIT_ACTIVITIES = ['disqualified', 'auto-disqualified']
+
+# Process version cutovers : an application of the department whose first activity in the department is after the
+# cutover date follows the new version of the process , its rows get 1 in the flag column (0 otherwise). The flag
+# columns are keys of the process step dictionary
+PROCESS_VERSION_CUTOVERS = [
+    {'Department_ST': 'Business Research', 'cutover': '2023-07-01', 'flag': 'BR_updated_in_july_2023'},
+]
+
+# Columns of the jobs dictionary (JOB_TO_KEEP_DICT) used to validate the job titles of the activity report
+JOBS_DICT_COLS = ['Job', 'Job To Keep']
+
+# Low-cardinality text columns of the dictionaries held as categoricals in a canonical form (see to_vocabulary) , per
+# input of the run context. They are normalised once when the run context is built , the same columns of the activity
+# report are normalised by the stages creating them. Values are stripped and lowercased , except the columns of
+# DISPLAY_CASE_VOCABULARY_COLUMNS which keep the case used in the dictionaries and in the outputs
+VOCABULARY_COLUMNS = {
+    'is_senior_df': ['Job Position'],
+    'process_step_df': ['New_Activity', 'Process_Step', 'Department_ST'],
+    'targets_df': ['Stage_advancement', 'Department_ST'],
+    'ranking_dict_df': ['Process_Step', 'Department_ST'],
+}
+DISPLAY_CASE_VOCABULARY_COLUMNS = ['Department_ST']
+# Same columns in the golden source
+GOLDEN_SOURCE_VOCABULARY_COLUMNS = ['New_Activity', 'Process_Step', 'Department_ST', 'Job Position']
+
+# Null policy of the golden source in the process step stage (see apply_null_policy) : nulls of the 'text' columns
+# become '' , the 'flag' columns become nullable integers (nulls kept as <NA>). The other columns keep their dtype and
+# their nulls (NaT for the timestamps , NaN for the numbers)
+GOLDEN_SOURCE_NULL_POLICY = {
+    'text': ['Name', 'Activity', 'Candidate', 'Job', 'New_Activity', 'Explanation', 'new_Job', 'ID_disqualified_OK',
+             'Department', 'Job Position', 'Location', 'Specificities', 'country', 'Department_ST'],
+    'flag': ['Name_Is_HRTeam', 'Act_Is_Step'],
+}
 
-# File path
-file_path = ACTIVITY_REPORT_PATH
-activity_report_df = read_file(file_path)
-# Calculate the total number of rows
-total_rows_from_source = len(activity_report_df)
 
-COLUMNS_TO_DROP_FROM_GOLDEN_SOURCE = ['level_0','level_1','index','Act_Is_Step','Explanation','act_is_referred','ID','Activity_done_same_time_ID'
+COLUMNS_TO_DROP_FROM_GOLDEN_SOURCE = ['level_0','index','Act_Is_Step','Explanation','act_is_referred','ID','Candidate_key','Job_key','Activity_done_same_time_ID'
         ,'Disqualified','entrance','Nb_of_appl_entrance','Nb_of_appl_disq','nb_of_app_difference','ID_disqualified_OK'
                        ,'ID_Nb_Act_Distinct','ID_Nb_Replicate_Act']
\ No newline at end of file
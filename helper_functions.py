@@ -1,10 +1,148 @@
 
 import os
+import glob
+import hashlib
+import threading
+import numpy as np
 import pandas as pd
 from pprint import pprint
 
+from pandas.api.types import union_categoricals, is_datetime64_any_dtype
 
-def read_file(file_path: str) -> pd.DataFrame:
+from constants import (CACHE_DIR_PATH, CACHEABLE_EXTENSIONS, ACTIVITY_REPORT_COLS, ACTIVITY_REPORT_CATEGORY_COLS,
+                       ACTIVITY_REPORT_MEMORY_BUDGET_MB, ACTIVITY_REPORT_SAMPLE_ROWS, ERROR_ACTIVITY_REPORT_INVALID,
+                       ERROR_NO_ACTIVITY_EVENT_EXPORT, WARNING_ACTIVITY_REPORT_NOT_EVENTS, DATE_FORMATS, TIMESTAMP_SAMPLE_SIZE, DISPLAY_CASE_VOCABULARY_COLUMNS)
+
+# pyarrow is the Parquet engine used by the input cache , without it every file is parsed from source
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Hit / miss counters of the input cache for the current process
+CACHE_STATS = {'hits': 0, 'misses': 0}
+_CACHE_STATS_LOCK = threading.Lock()
+
+
+def file_content_hash(file_path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of the content of a file , read in 1 MB blocks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dataframe_hash(df: pd.DataFrame) -> str:
+    """
+    Returns the SHA-256 hex digest of the content of a DataFrame : its column names and dtypes , and every row.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr([(str(column), str(dtype)) for column, dtype in df.dtypes.items()]).encode())
+    try:
+        row_hashes = pd.util.hash_pandas_object(df, index=True)
+    except TypeError:
+        # Unhashable cells (e.g. lists) are hashed through their text
+        row_hashes = pd.util.hash_pandas_object(df.astype(str), index=True)
+    digest.update(row_hashes.to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def get_cache_stats() -> dict:
+    """
+    Returns a copy of the input cache hit / miss counters.
+    """
+    with _CACHE_STATS_LOCK:
+        return dict(CACHE_STATS)
+
+
+def merge_cache_stats(stats: dict):
+    """
+    Adds hit / miss counters gathered in another process (e.g. a loader worker) to the counters of this process.
+    """
+    with _CACHE_STATS_LOCK:
+        for event, count in stats.items():
+            CACHE_STATS[event] += count
+
+
+def _count_cache(event: str):
+    with _CACHE_STATS_LOCK:
+        CACHE_STATS[event] += 1
+
+
+def _cache_stem(file_path: str, variant: str = '') -> str:
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return f"{stem}.{variant}" if variant else stem
+
+
+def parquet_unsafe_columns(df: pd.DataFrame) -> list:
+    """
+    Returns the object columns of `df` not holding text only. Parquet fails on mixed types (e.g. a '?' in a column of
+    numbers) and gives back the numbers of an object column as floats , such frames are kept as pickle instead.
+    """
+    return [column for column in df.select_dtypes('object').columns
+            if pd.api.types.infer_dtype(df[column], skipna=True) not in ('string', 'empty')]
+
+
+def _cache_paths(file_path: str, content_hash: str, variant: str = '') -> tuple:
+    stem = os.path.join(CACHE_DIR_PATH, f"{_cache_stem(file_path, variant)}-{content_hash[:16]}")
+    return f"{stem}.parquet", f"{stem}.pkl"
+
+
+def _write_cache(df: pd.DataFrame, file_path: str, content_hash: str, variant: str = ''):
+    os.makedirs(CACHE_DIR_PATH, exist_ok=True)
+    parquet_path, pickle_path = _cache_paths(file_path, content_hash, variant)
+    try:
+        unsafe_columns = parquet_unsafe_columns(df)
+        if unsafe_columns:
+            raise ValueError(f"object columns not holding text only : {unsafe_columns}")
+        df.to_parquet(parquet_path, index=False)
+    except (ValueError, TypeError) as e:
+        print(f"- Input cache of {os.path.basename(file_path)} kept as pickle: {e}")
+        if os.path.exists(parquet_path):
+            os.remove(parquet_path)
+        df.to_pickle(pickle_path)
+
+    # Drop the entries of previous versions of the same file
+    stale_pattern = glob.escape(_cache_stem(file_path, variant)) + '-' + '?' * 16 + '.*'
+    for stale_path in glob.glob(os.path.join(CACHE_DIR_PATH, stale_pattern)):
+        if stale_path not in (parquet_path, pickle_path):
+            os.remove(stale_path)
+
+
+def _read_through_cache(file_path: str, read_function, variant: str = '') -> pd.DataFrame:
+    """
+    Serves `read_function(file_path)` from the cache (Parquet , or pickle when Parquet cannot hold it) when the
+    content of the file is unchanged, otherwise runs it and stores its result. `variant` separates the entries of
+    different readers of the same file.
+    """
+    content_hash = file_content_hash(file_path)
+    parquet_path, pickle_path = _cache_paths(file_path, content_hash, variant)
+    if os.path.exists(parquet_path):
+        _count_cache('hits')
+        # Parquet gives back None for missing text values , restore NaN as returned by the source readers
+        return pd.read_parquet(parquet_path).fillna(np.nan)
+    if os.path.exists(pickle_path):
+        _count_cache('hits')
+        return pd.read_pickle(pickle_path)
+
+    _count_cache('misses')
+    df = read_function(file_path)
+    _write_cache(df, file_path, content_hash, variant)
+
+    return df
+
+
+def read_file(file_path: str, use_cache: bool = True) -> pd.DataFrame:
+    """
+    Reads a file into a DataFrame using the reader matching its extension.
+
+    CSV and Excel files are served from a Parquet (or pickle) copy kept in CACHE_DIR_PATH when the source file is
+    unchanged (the cache entry is keyed by a hash of the file content). The copy is rebuilt whenever the source changes.
+    """
     # Derive the file extension using os module
 
     SUPPORTED_EXTENSIONS = {
@@ -40,10 +178,11 @@ def read_file(file_path: str) -> pd.DataFrame:
     # Retrieve the appropriate read function based on the file extension
     read_function = READ_FUNCTIONS[file_extension]
 
-    # Read the file using the read function
-    df = read_function(file_path)
+    if not (use_cache and PARQUET_AVAILABLE and file_extension in CACHEABLE_EXTENSIONS):
+        # Read the file using the read function
+        return read_function(file_path)
 
-    return df
+    return _read_through_cache(file_path, read_function)
 
 def validate_dataframe(df, required_cols):
     """
@@ -66,3 +205,372 @@ def validate_dataframe(df, required_cols):
         return False
 
     return True
+
+
+def _missing_activity_report_columns(columns) -> list:
+    """
+    Returns the columns of ACTIVITY_REPORT_COLS missing from `columns` (matched on stripped, lowercased names as in
+    validate_dataframe).
+    """
+    names = {str(col).strip().lower() for col in columns}
+    return [col for col in ACTIVITY_REPORT_COLS if col.strip().lower() not in names]
+
+
+def _read_activity_report_header(file_path: str):
+    """
+    Returns the column names of a CSV or Excel activity export without parsing its rows , None for other formats.
+    """
+    _, file_extension = os.path.splitext(file_path)
+    file_extension = file_extension.lower()
+    if file_extension == '.csv':
+        return pd.read_csv(file_path, nrows=0).columns
+    if file_extension in ('.xlsx', '.xls'):
+        return pd.read_excel(file_path, nrows=0).columns
+    return None
+
+
+def _resolve_activity_report_columns(columns, file_path: str) -> dict:
+    """
+    Maps the columns of an activity export to the names of ACTIVITY_REPORT_COLS (matched on stripped, lowercased
+    names as in validate_dataframe). Raises a ValueError naming `file_path` if a required column is missing.
+    """
+    required_cols = {col.strip().lower(): col for col in ACTIVITY_REPORT_COLS}
+    resolved = {col: required_cols[col.strip().lower()] for col in columns if col.strip().lower() in required_cols}
+
+    if len(set(resolved.values())) < len(ACTIVITY_REPORT_COLS):
+        validate_dataframe(pd.DataFrame(columns=list(columns)), ACTIVITY_REPORT_COLS)
+        raise ValueError(ERROR_ACTIVITY_REPORT_INVALID.format(file_path, 'header'))
+
+    return resolved
+
+
+def _read_activity_report_csv(file_path: str, memory_budget_mb: int) -> pd.DataFrame:
+    # Only parse the required columns
+    columns = _resolve_activity_report_columns(pd.read_csv(file_path, nrows=0).columns, file_path)
+
+    # Size the chunks from the footprint of a sample read as plain object columns
+    sample_df = pd.read_csv(file_path, usecols=list(columns), nrows=ACTIVITY_REPORT_SAMPLE_ROWS)
+    bytes_per_row = max(1, sample_df.memory_usage(deep=True, index=False).sum() / max(len(sample_df), 1))
+    chunk_rows = max(1000, int(memory_budget_mb * 1024 * 1024 / bytes_per_row))
+
+    dtypes = {col: 'category' if name in ACTIVITY_REPORT_CATEGORY_COLS else str for col, name in columns.items()}
+    chunks = []
+    for chunk_number, chunk in enumerate(pd.read_csv(file_path, usecols=list(columns), dtype=dtypes,
+                                                     chunksize=chunk_rows), start=1):
+        chunk = chunk.rename(columns=columns)
+        if not validate_dataframe(chunk, ACTIVITY_REPORT_COLS):
+            raise ValueError(ERROR_ACTIVITY_REPORT_INVALID.format(file_path, chunk_number))
+        chunks.append(chunk)
+
+    return _concat_activity_frames(chunks)
+
+
+def _concat_activity_frames(frames: list) -> pd.DataFrame:
+    """
+    Concatenates activity report frames , merging the categories of each frame instead of falling back to object
+    columns.
+    """
+    if not frames:
+        return pd.DataFrame(columns=ACTIVITY_REPORT_COLS)
+
+    activity_report_df = pd.concat([df.drop(columns=ACTIVITY_REPORT_CATEGORY_COLS) for df in frames],
+                                   ignore_index=True)
+    for col in ACTIVITY_REPORT_CATEGORY_COLS:
+        activity_report_df[col] = union_categoricals([df[col] for df in frames])
+
+    return activity_report_df[ACTIVITY_REPORT_COLS]
+
+
+def read_activity_report(file_path: str, memory_budget_mb: int = ACTIVITY_REPORT_MEMORY_BUDGET_MB,
+                         use_cache: bool = True) -> pd.DataFrame:
+    """
+    Reads a Workable activity export , keeping only the columns of ACTIVITY_REPORT_COLS.
+
+    'Name', 'Activity' and 'Job' are loaded as categoricals. CSV exports are parsed in chunks sized so that each chunk
+    stays within `memory_budget_mb`, and every chunk is validated as it is read. Other formats are read with read_file
+    and projected afterwards. The typed result is kept in the input cache like any other input.
+
+    Raises:
+        ValueError: If the export misses a required column or a chunk is empty.
+    """
+    _, file_extension = os.path.splitext(file_path)
+    file_extension = file_extension.lower()
+
+    def load(path):
+        if file_extension == '.csv':
+            return _read_activity_report_csv(path, memory_budget_mb)
+
+        activity_report_df = read_file(path, use_cache=False)
+        columns = _resolve_activity_report_columns(activity_report_df.columns, path)
+        activity_report_df = activity_report_df[list(columns)].rename(columns=columns)[ACTIVITY_REPORT_COLS]
+        return activity_report_df.astype({col: 'category' for col in ACTIVITY_REPORT_CATEGORY_COLS})
+
+    if not (use_cache and PARQUET_AVAILABLE and file_extension in CACHEABLE_EXTENSIONS):
+        return load(file_path)
+
+    return _read_through_cache(file_path, load, variant='activity')
+
+
+def normalize_timestamps(series: pd.Series, formats: list = DATE_FORMATS,
+                         sample_size: int = TIMESTAMP_SAMPLE_SIZE) -> pd.Series:
+    """
+    Converts a column of timestamps written in one or several of `formats` to datetime64.
+
+    The formats are ranked by how many values of a sample they parse , then each distinct string is parsed once with
+    the first format that fits it (values that fit none of them are left to pandas inference) and the result is
+    broadcast back to the rows. A column already holding datetime64 values is returned as is , which lets the
+    downstream stages call it without converting the column again.
+
+    Raises:
+        ValueError: If some values cannot be parsed as a timestamp.
+    """
+    if is_datetime64_any_dtype(series):
+        return series
+
+    codes, uniques = pd.factorize(series)
+    uniques = pd.Series(uniques, dtype=object).astype(str)
+
+    # Detect the formats used from a sample of the distinct values
+    sample = uniques.sample(min(sample_size, len(uniques)), random_state=0)
+    sample_hits = [pd.to_datetime(sample, format=date_format, errors='coerce').notna().sum() for date_format in formats]
+    ranked_formats = [date_format for _, _, date_format in
+                      sorted(zip(sample_hits, range(len(formats)), formats), key=lambda x: (-x[0], x[1]))]
+
+    parsed = pd.Series(pd.NaT, index=uniques.index, dtype='datetime64[ns]')
+    for date_format in ranked_formats:
+        remaining = parsed.isna()
+        if not remaining.any():
+            break
+        parsed[remaining] = pd.to_datetime(uniques[remaining], format=date_format, errors='coerce')
+
+    remaining = parsed.isna()
+    if remaining.any():
+        parsed[remaining] = pd.to_datetime(uniques[remaining], format='mixed', errors='coerce')
+        unparsed = uniques[parsed.isna()]
+        if not unparsed.empty:
+            raise ValueError(f"{len(unparsed)} values of '{series.name}' are not valid timestamps , "
+                             f"e.g. {unparsed.head(3).tolist()}")
+
+    # Broadcast the parsed distinct values back to the rows , missing values (code -1) stay NaT
+    values = parsed.to_numpy()
+    return pd.Series(np.where(codes >= 0, values[codes], np.datetime64('NaT')), index=series.index,
+                     name=series.name, dtype='datetime64[ns]')
+
+
+def to_vocabulary(series: pd.Series, lowercase: bool = True) -> pd.Series:
+    """
+    Returns `series` as a categorical holding the canonical form of its values : stripped , and lowercased unless
+    `lowercase` is False. Values sharing a canonical form (e.g. 'Hired' and 'hired ') become the same category.
+
+    The normalisation runs once per distinct value , or once per category when `series` is already categorical , so
+    its cost scales with the size of the vocabulary rather than the number of rows. Missing values are kept.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, values = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, values = pd.factorize(series)
+
+    canonical = pd.Index(values, dtype=object).astype(str).str.strip()
+    if lowercase:
+        canonical = canonical.str.lower()
+    canonical_codes, categories = pd.factorize(canonical, sort=True)
+
+    categorical = pd.Categorical.from_codes(np.where(codes >= 0, canonical_codes[codes], -1), categories=categories)
+    return pd.Series(categorical, index=series.index, name=series.name)
+
+
+def normalize_vocabulary(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """
+    Returns a copy of `df` where `columns` are turned into canonical categoricals (see to_vocabulary). The columns of
+    DISPLAY_CASE_VOCABULARY_COLUMNS keep their case. Columns missing from `df` are ignored.
+    """
+    df = df.copy()
+    for col in columns:
+        if col in df.columns:
+            df[col] = to_vocabulary(df[col], lowercase=col not in DISPLAY_CASE_VOCABULARY_COLUMNS)
+    return df
+
+
+def merge_vocabulary(left: pd.DataFrame, right: pd.DataFrame, on: list, how: str = 'left') -> pd.DataFrame:
+    """
+    pd.merge on `on` , where the keys that are categorical on at least one side are first turned into categoricals with
+    the same categories on both sides (the values of the other side are matched as they are , not normalised). The join
+    then runs on the category codes and the keys stay categorical in the result , instead of being cast to object.
+    """
+    def key_categories(series: pd.Series) -> pd.Index:
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return series.cat.categories
+        return pd.Index(series.dropna().unique())
+
+    left_keys, right_keys = {}, {}
+    for col in on:
+        if isinstance(left[col].dtype, pd.CategoricalDtype) or isinstance(right[col].dtype, pd.CategoricalDtype):
+            dtype = pd.CategoricalDtype(key_categories(left[col]).union(key_categories(right[col])))
+            left_keys[col] = left[col].astype(dtype)
+            right_keys[col] = right[col].astype(dtype)
+    return pd.merge(left.assign(**left_keys), right.assign(**right_keys), on=on, how=how)
+
+
+def fill_vocabulary(series: pd.Series, value: str) -> pd.Series:
+    """
+    Fills the missing values of a column with `value` , adding it to the categories first when the column is
+    categorical.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
+
+
+def apply_null_policy(df: pd.DataFrame, policy: dict) -> pd.DataFrame:
+    """
+    Returns a copy of `df` where the nulls of the columns listed in `policy` are handled by kind : '' for the 'text'
+    columns , nullable Int8 (nulls kept as <NA>) for the 'flag' columns. The columns not listed are left untouched , so
+    numeric and datetime columns keep their dtype. Listed columns missing from `df` are skipped.
+    """
+    df = df.copy()
+    for column in policy.get('text', []):
+        if column not in df.columns:
+            continue
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = fill_vocabulary(df[column], '')
+        else:
+            df[column] = df[column].fillna('')
+    for column in policy.get('flag', []):
+        if column in df.columns:
+            df[column] = df[column].astype('Int8')
+    return df
+
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the memory used by each column of `df` (deep , so the text of object columns is counted) with its dtype ,
+    largest first.
+    """
+    report_df = pd.DataFrame({'dtype': df.dtypes.astype(str), 'bytes': df.memory_usage(index=False, deep=True)})
+    return report_df.sort_values(by='bytes', ascending=False)
+
+
+def read_activity_reports(file_paths, memory_budget_mb: int = ACTIVITY_REPORT_MEMORY_BUDGET_MB) -> pd.DataFrame:
+    """
+    Reads one or several overlapping Workable activity exports into a single activity report.
+
+    Args:
+        file_paths: A path , a glob pattern (e.g. ".\\input_data\\activity_report_*.csv") or a list of them.
+            Matching files are read in name order.
+        memory_budget_mb: Memory allowed per parsed chunk of a CSV export (see read_activity_report).
+
+    Returns:
+        pd.DataFrame: The concatenated exports. An event (Name , Activity , Candidate , Job , Creation time) already
+        read from a previous export is dropped , using an index of the hashes of the events read so far. Repeated
+        events inside a single export are kept. Files without the columns of an event export are skipped with a
+        warning.
+
+    Raises:
+        ValueError: If no file is an event export , or an event export fails validation (the message names the file).
+    """
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+
+    export_paths = []
+    for file_path in file_paths:
+        # A plain path is kept as is so that a missing file raises FileNotFoundError
+        export_paths.extend(sorted(glob.glob(file_path)) if glob.has_magic(file_path) else [file_path])
+    if not export_paths:
+        raise FileNotFoundError(f"No activity export matches {file_paths}")
+
+    exports, seen_hashes = [], pd.Index([], dtype='uint64')
+    for export_path in export_paths:
+        # Other layouts of the exports (e.g. the pivoted '_with_breakdown' report : one row per job and candidate ,
+        # without activities nor times) hold no event to ingest
+        header = _read_activity_report_header(export_path)
+        missing_cols = [] if header is None else _missing_activity_report_columns(header)
+        if missing_cols:
+            print(WARNING_ACTIVITY_REPORT_NOT_EVENTS.format(export_path, missing_cols))
+            continue
+
+        export_df = read_activity_report(export_path, memory_budget_mb)
+        # Creation time formats differ between exports , parse them before comparing events
+        export_df['Creation time'] = normalize_timestamps(export_df['Creation time'])
+
+        event_hashes = pd.util.hash_pandas_object(export_df[ACTIVITY_REPORT_COLS], index=False)
+        already_read = event_hashes.isin(seen_hashes).to_numpy()
+        print(f" - {os.path.basename(export_path)} : {len(export_df)} rows , "
+              f"{already_read.sum()} already read from a previous export")
+
+        exports.append(export_df[~already_read])
+        seen_hashes = seen_hashes.append(pd.Index(event_hashes[~already_read].unique()))
+
+    if not exports:
+        raise ValueError(ERROR_NO_ACTIVITY_EVENT_EXPORT.format(export_paths))
+
+    return _concat_activity_frames(exports)
+
+
+class KeyRegistry:
+    """
+    Integer surrogate keys for the identifiers of a run (Candidate , Job , ID , unique_ID).
+
+    A key is an int64 code given to each distinct combination of its components , in order of first appearance. Codes
+    are shared by every call made on the same registry , so the keys of the branches processed separately can be
+    concatenated. The components of each code are kept in a lookup table and the readable labels are only built at
+    export time (see materialize).
+    """
+
+    def __init__(self):
+        # key name -> (component names , pd.Index or pd.MultiIndex of the registered components , position = code)
+        self.lookups = {}
+
+    def encode(self, key_name: str, components) -> np.ndarray:
+        """
+        Returns the codes of `components` (a Series or a DataFrame with one column per component) under `key_name`,
+        registering the combinations not seen before.
+        """
+        if isinstance(components, pd.Series):
+            components = components.to_frame()
+        if not isinstance(components, pd.DataFrame):
+            raise TypeError("components must be a pandas Series or DataFrame")
+
+        if components.shape[1] == 1:
+            values = pd.Index(components.iloc[:, 0].astype(object), name=components.columns[0])
+        else:
+            values = pd.MultiIndex.from_frame(components.astype(object))
+        codes, uniques = values.factorize(use_na_sentinel=False)
+
+        component_names, registered = self.lookups.get(key_name, (list(components.columns), uniques[:0]))
+        if component_names != list(components.columns):
+            raise ValueError(f"Key {key_name} is made of {component_names} , not {list(components.columns)}")
+
+        positions = registered.get_indexer(uniques)
+        new_values = positions == -1
+        positions[new_values] = len(registered) + np.arange(new_values.sum())
+        self.lookups[key_name] = (component_names, registered.append(uniques[new_values]))
+
+        return positions.astype(np.int64)[codes]
+
+    def lookup(self, key_name: str) -> pd.DataFrame:
+        """
+        Returns the lookup table of `key_name` : one row per code with the value of each component.
+        """
+        component_names, registered = self.lookups[key_name]
+        lookup_df = registered.to_frame(index=False)
+        lookup_df.columns = component_names
+        lookup_df.index.name = key_name
+        return lookup_df
+
+    def labels(self, key_name: str, codes) -> np.ndarray:
+        """
+        Returns the readable labels of `codes` : the components of each key joined with '_' (e.g. Candidate_Job).
+        """
+        labels = self.lookup(key_name).astype(str).agg('_'.join, axis=1).to_numpy()
+        codes = np.asarray(codes, dtype=np.int64)
+        return labels[codes]
+
+    def materialize(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Returns a copy of `df` where the columns named after a registered key hold readable labels instead of codes.
+        """
+        df = df.copy()
+        for key_name in self.lookups:
+            if key_name in df.columns:
+                df[key_name] = self.labels(key_name, df[key_name])
+        return df
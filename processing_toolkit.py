@@ -1,33 +1,118 @@
 from Toolkit import *
-from constants import total_rows_from_source , DATE_FORMATS
+from constants import ACTIVITY_REWRITE_RULES
+from run_context import RunContext
+from helper_functions import normalize_timestamps, to_vocabulary, merge_vocabulary
 import os
 
 
-def preliminary_processing(activity_report_df: pd.DataFrame,
-                          activity_dict_df: pd.DataFrame,
-                          hr_names_df: pd.DataFrame) -> pd.DataFrame:
+def apply_activity_rewrite_rules(activity_vocabulary_df: pd.DataFrame, rules: list = ACTIVITY_REWRITE_RULES) -> pd.DataFrame:
     """
-    Merge , clean and create two dataframes from four DataFrames: `activity_report_df`, `activity_dict_df`,
-    `hr_names_df`, and `process_step_df`. Keeping only activities that are a process step.
+    Applies the activity rewrite rules (see ACTIVITY_REWRITE_RULES in constants.py) to a table of distinct activities.
+
+    Args:
+        activity_vocabulary_df: One row per distinct 'Activity' , with the 'New_Activity' and 'Act_Is_Step' values of
+            the activity dictionary.
+        rules: The rules to apply , in order. Each rule sees the values written by the previous ones.
+
+    Returns:
+        pd.DataFrame: The rewritten table , with one 0/1 column per flag used by the rules.
+    """
+    activity_vocabulary_df = activity_vocabulary_df.copy()
+
+    for rule in rules:
+        values = activity_vocabulary_df[rule['match']].astype(object).str.lower()
+        if 'contains' in rule:
+            mask = values.str.contains(rule['contains'], regex=False).fillna(False).astype(bool)
+        else:
+            mask = (values == rule['equals'])
+
+        for col in ['New_Activity', 'Act_Is_Step']:
+            if col in rule:
+                activity_vocabulary_df.loc[mask, col] = rule[col]
+        if 'flag' in rule:
+            if rule['flag'] not in activity_vocabulary_df.columns:
+                activity_vocabulary_df[rule['flag']] = 0
+            activity_vocabulary_df.loc[mask, rule['flag']] = 1
+
+    return activity_vocabulary_df
+
+
+def map_distinct(series: pd.Series, func) -> np.ndarray:
+    """
+    Evaluates `func` (Series -> Series) once on the distinct values of `series` and broadcasts the result to the rows.
+    Missing values are passed to `func` as NaN.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    return func(pd.Series(uniques, dtype=object)).to_numpy()[codes]
+
+
+# Per-candidate flags : flag column -> function returning the 0/1 mask of the rows of the merged activity report
+# (after the activity rewrite rules) that set the flag. A candidate gets 1 if any of their rows is in the mask.
+CANDIDATE_FLAGS = {}
+
+
+def register_candidate_flag(flag_name: str, row_mask):
+    """
+    Registers a per-candidate flag computed by compute_candidate_flags.
+
+    Args:
+        flag_name: The column created on every row of the candidate.
+        row_mask: A function taking the merged activity report and returning a boolean mask of its rows.
+    """
+    CANDIDATE_FLAGS[flag_name] = row_mask
+
+
+# Candidate has a talent pool activity
+register_candidate_flag('is_talent_pool', lambda df: map_distinct(
+    df['Activity'], lambda x: x.str.lower().str.contains('talent', regex=False).fillna(False)))
+# Candidate has been referred at one point
+register_candidate_flag('Candidate_is_referred', lambda df: (df['Act_Is_Step'] == 1) & (df['act_is_referred'] == 1))
+# Candidate has moved to a job position
+register_candidate_flag('Candidate_movedtojobposition', lambda df: (df['Act_Is_Step'] == 1) & map_distinct(
+    df['New_Activity'], lambda x: x.str.lower().str.contains('moved to job position', regex=False).fillna(False)))
+
+
+def compute_candidate_flags(df: pd.DataFrame, flags: dict = None) -> pd.DataFrame:
+    """
+    Computes the per-candidate flags in a single groupby over the stacked row masks of all the flags.
+
+    Returns:
+        pd.DataFrame: One 0/1 column per flag , aligned on the rows of `df`.
+    """
+    flags = CANDIDATE_FLAGS if flags is None else flags
+    row_masks_df = pd.DataFrame({flag_name: np.asarray(row_mask(df), dtype=bool) for flag_name, row_mask in flags.items()},
+                                index=df.index)
+    # rows without candidate (code -1) are not grouped together , they are left unflagged
+    candidate_codes = pd.factorize(df['Candidate'])[0]
+    candidate_flags_df = row_masks_df.groupby(candidate_codes).transform('max')
+    candidate_flags_df[candidate_codes < 0] = False
+    return candidate_flags_df.astype(int)
+
+
+def preliminary_processing(run_context: RunContext) -> pd.DataFrame:
+    """
+    Merge and clean three DataFrames of the run context: `activity_report_df`, `activity_dict_df` and `hr_names_df`.
+    Keeping only activities that are a process step.
 
     Parameters:
     -----------
-    activity_report_df : pd.DataFrame
-        A DataFrame containing activity report data.
-    activity_dict_df : pd.DataFrame
-        A DataFrame containing activity dictionary data.
-    hr_names_df : pd.DataFrame
-        A DataFrame containing HR employee names data.
+    run_context : RunContext
+        The run context holding the activity report, the activity dictionary and the HR employee names data.
 
 
     Returns:
     --------
     pd.DataFrame
-        two DataFrames : one with moved to job position candidates , and one with all the rest
+        The activities of all the candidates , with the flag 'Candidate_movedtojobposition' (see application_processing)
     """
 
     print(" #### Preliminary Processing Stage ### ")
 
+    activity_report_df = run_context.activity_report_df
+    activity_dict_df = run_context.activity_dict_df
+    hr_names_df = run_context.hr_names_df
+    total_rows_from_source = run_context.total_rows_from_source
+
     print("1. Merge activity report with the activity dictionary ")
     print(
         f" - Total rows from source : {total_rows_from_source} ({total_rows_from_source / total_rows_from_source * 100:.2f}%)")
@@ -38,37 +123,31 @@ def preliminary_processing(activity_report_df: pd.DataFrame,
 
 
 
-    # Function to parse datetime with different formats
-    def parse_datetime(df, column, formats):
-        for date_format in formats:
-            try:
-                df[column] = pd.to_datetime(df[column], format=date_format)
-                break  # Exit the loop if parsing is successful
-            except ValueError:
-                pass
-
-    # Call the function to parse datetime
-    parse_datetime(activity_report_df, 'Creation time', DATE_FORMATS)
+    # Parse datetime with different formats (no-op when the loader already parsed the column) , on a copy : the inputs
+    # of the run context are never modified (the stage checkpoints are keyed by their hashes)
+    activity_report_df = activity_report_df.assign(**{'Creation time': normalize_timestamps(activity_report_df['Creation time'])})
 
     #format_str = "%m/%d/%Y %I:%M:%S %p"
     #activity_report_df['Creation time'] = pd.to_datetime(activity_report_df['Creation time'])
 
 
 
-    # Merge activity_report_df with activity_dict_df based on 'Activity'
-    dict_activity_report_df = pd.merge(activity_report_df, activity_dict_df, on='Activity', how='left')
+    # Merge the distinct activities of the report with activity_dict_df , apply the rewrite rules on them
+    # (e.g. move to job/copied to job  XX --> "moved to job position" and act_is_step = 1) and broadcast back on 'Activity'
+    print( '2. Replace move to job/copied to job  XX with "moved to job position" in New_Activity column and act_is_step = 1 ')
+    activity_vocabulary_df = activity_report_df[['Activity']].drop_duplicates()
+    # 'Activity' and 'Name' are categoricals from the activity report loader , the joins keep them categorical
+    activity_vocabulary_df = merge_vocabulary(activity_vocabulary_df, activity_dict_df, on=['Activity'], how='left')
+    activity_vocabulary_df = apply_activity_rewrite_rules(activity_vocabulary_df)
+    dict_activity_report_df = merge_vocabulary(activity_report_df, activity_vocabulary_df, on=['Activity'], how='left')
     #dict_activity_report_df.to_excel('test_talent_pool.xlsx')
 
 
 
-    # Define a function to check if 'talent' is in the 'New_Activity' column
-    # Define a custom function to check for "talent" in any activity
-    def is_talent_pool(candidate_activities):
-        return 1 if any('talent' in activity.lower() for activity in candidate_activities) else 0
-
-    # Apply the custom function to create the 'is_talent_pool' column
-    dict_activity_report_df['is_talent_pool'] = dict_activity_report_df.groupby('Candidate')['Activity'].transform(
-        lambda x: is_talent_pool(x))
+    # Compute the candidate flags ( 'is_talent_pool' , 'Candidate_is_referred' , 'Candidate_movedtojobposition' ... )
+    # in one pass , see CANDIDATE_FLAGS
+    candidate_flags_df = compute_candidate_flags(dict_activity_report_df)
+    dict_activity_report_df[candidate_flags_df.columns] = candidate_flags_df
 
 
     """def is_talent_pool(activity_value):
@@ -96,20 +175,6 @@ def preliminary_processing(activity_report_df: pd.DataFrame,
     #print("- Number of rows dropped ( rows with talent pool activities ) :", rows_dropped)
     filtered_dict_activity_report_df = dict_activity_report_df
 
-    print( '2. Replace move to job/copied to job  XX with "moved to job position" in New_Activity column and act_is_step = 1 ')
-    #  update 'New_Activity' based on the condition
-    # Use the apply method to update 'New_Activity' based on the condition
-    # Define a function to update 'Act_Is_Step' and 'New_Activity' columns
-    def update_activity_and_flag(row):
-        if ('moved to job' in row['Activity'].lower() or 'copied to job' in row['Activity'].lower()):
-            row['Act_Is_Step'] = 1
-            row['New_Activity'] = 'moved to job position'
-        return row
-
-    # Apply the function to each row in the DataFrame
-    filtered_dict_activity_report_df = filtered_dict_activity_report_df.apply(update_activity_and_flag, axis=1)
-
-
 
     # Keep only the activities that are a step
     print("3. Filter out activities which are not a step ")
@@ -137,8 +202,6 @@ def preliminary_processing(activity_report_df: pd.DataFrame,
 
     #dict_activity_report_df.to_excel("test_act_report.xlsx", index=False)
     # merge to add the column Name_is_HR
-    # Replace 'woken up' with 'unsnoozed' in the Activity column
-    activity_step_report_df['New_Activity'] = activity_step_report_df['New_Activity'].replace('woken up', 'unsnoozed')
     # Use boolean indexing to drop rows where the Candidate column is empty or '-'
     activity_step_report_df = activity_step_report_df[
         (activity_step_report_df['Candidate'] != '') & (activity_step_report_df['Candidate'] != '-')]
@@ -149,18 +212,10 @@ def preliminary_processing(activity_report_df: pd.DataFrame,
         f" - Total rows with Candidate Name  : {total_rows_candidate_not_empty} ({total_rows_candidate_not_empty / total_rows_from_source * 100:.2f}%)")
     print(f"- Total rows dropped in this step: {total_rows_act_is_step - total_rows_candidate_not_empty}")
 
-    # create a new column that equals 1 if the candidate has been referred at one point and drop the activity 'Referred a candidate'
-    activity_step_report_df["act_is_referred"] = activity_step_report_df.apply(
-        lambda x: 1 if (x['New_Activity'] == "referred a candidate") else 0, axis=1)
-    max_values = activity_step_report_df.groupby('Candidate')['act_is_referred'].max()
-
-
-
-    # Create a new column in the original DataFrame that is equal to 1 for each ID that has a maximum value of 1
-    activity_step_report_df['Candidate_is_referred'] = activity_step_report_df['Candidate'].map(max_values).fillna(0)
-    refffered_report_df = activity_step_report_df[
-        activity_step_report_df['New_Activity'].str.lower() == "referred a candidate"]
-    activity_step_report_df = activity_step_report_df[activity_step_report_df['New_Activity'].str.lower() != "referred a candidate"]
+    # drop the activity 'Referred a candidate' ( 'act_is_referred' is set by the activity rewrite rules ,
+    # 'Candidate_is_referred' by the candidate flags )
+    refffered_report_df = activity_step_report_df[activity_step_report_df['act_is_referred'] == 1]
+    activity_step_report_df = activity_step_report_df[activity_step_report_df['act_is_referred'] == 0]
 
     total_rows_without_reffered_a_candidate = len(activity_step_report_df)
     print(
@@ -177,14 +232,11 @@ def preliminary_processing(activity_report_df: pd.DataFrame,
     activity_step_report_df = activity_step_report_df.reset_index(drop=True)
 
 
-    # Create a new column called 'Candidate_Appl_movedtojobposition' that indicates whether a candidate has moved to a job position
-    activity_step_report_df['Candidate_movedtojobposition'] = activity_step_report_df.groupby('Candidate')[
-        'New_Activity'].transform(lambda
-                                      x: int(any('moved to job position' in activity for activity in x)))
-
-    # Create temp ID , Combine the 'Candidate' and 'Job' columns to create a new column 'ID'
-    activity_step_report_df['ID'] = activity_step_report_df.apply(lambda row: f"{row['Candidate']}_{row['Job']}",
-                                                                  axis=1)
+    # Create the integer keys of the candidates and jobs , and the temp ID = Candidate + Job (see KeyRegistry)
+    key_registry = run_context.key_registry
+    activity_step_report_df['Candidate_key'] = key_registry.encode('Candidate_key', activity_step_report_df['Candidate'])
+    activity_step_report_df['Job_key'] = key_registry.encode('Job_key', activity_step_report_df['Job'])
+    activity_step_report_df['ID'] = key_registry.encode('ID', activity_step_report_df[['Candidate', 'Job']])
 
     # Add a new Column called : new_job , which will be later transformed for some records after the creation of the new ID
     activity_step_report_df['new_Job'] = activity_step_report_df['Job']
@@ -193,31 +245,18 @@ def preliminary_processing(activity_report_df: pd.DataFrame,
 
 
     print('4. Merge with HR_dictionary to create the column HR_is_Name')
-    hr_dict_activity_report_df = pd.merge(activity_step_report_df, hr_names_df, on='Name', how='left')
+    hr_dict_activity_report_df = merge_vocabulary(activity_step_report_df, hr_names_df, on=['Name'], how='left')
     #hr_dict_activity_report_df.to_excel('hr_dic_check.xlsx')
     #exit(1)
     #df["Creation time"] = pd.to_datetime(df["Creation time"], format='%d/%m/%y %H:%M:%S', errors='coerce')
-    # Convert 'New_activity' column to string data type, then convert all values to lowercase and remove any leading/trailing whitespace
-    hr_dict_activity_report_df['New_Activity'] = hr_dict_activity_report_df['New_Activity'].astype(str)
-    hr_dict_activity_report_df['New_Activity'] = hr_dict_activity_report_df['New_Activity'].str.lower().str.strip()
+    # Convert 'New_activity' column to a categorical of lowercase values without leading/trailing whitespace
+    hr_dict_activity_report_df['New_Activity'] = to_vocabulary(hr_dict_activity_report_df['New_Activity'])
     # Convert the 'Creation time' column to a timestamp
     #hr_dict_activity_report_df['Creation time'] = pd.to_datetime(activity_report_df['Creation time'])
 
 
-    print('5. Separate Candidates with Moved to Job position from the rest ')
-    # subset the DataFrame based on the value of 'Candidate_movedtojobposition'
-    moved_to_job_df = hr_dict_activity_report_df.loc[hr_dict_activity_report_df['Candidate_movedtojobposition'] == 1]
-    moved_to_job_df.reset_index(inplace=True)
-    not_moved_to_job_df = hr_dict_activity_report_df.loc[hr_dict_activity_report_df['Candidate_movedtojobposition'] == 0]
-    not_moved_to_job_df.reset_index(inplace=True)
-
-    # upload the temp dataframes to the temp file
-    #export_path=r'.\temp'
-    #moved_to_job_df.to_excel(os.path.join(export_path, 'moved_to_job_df.xlsx'))
-    #not_moved_to_job_df.to_excel(os.path.join(export_path, 'not_moved_to_job_df.xlsx'))
-
     # Stats on Candidates without Moved to Job
-
+    not_moved_to_job_df = hr_dict_activity_report_df.loc[hr_dict_activity_report_df['Candidate_movedtojobposition'] == 0]
     num_rows_not_moved_to_job_df = len(not_moved_to_job_df)
     percentage_not_moved_to_job_df = (num_rows_not_moved_to_job_df / total_rows_from_source) * 100
     unique_ids_df2 = not_moved_to_job_df['ID'].nunique()
@@ -228,170 +267,110 @@ def preliminary_processing(activity_report_df: pd.DataFrame,
     print(f"- Number of unique application IDs: {unique_ids_df2}")
 
 
-    return moved_to_job_df,not_moved_to_job_df
-
+    return hr_dict_activity_report_df
 
 
-def not_moved_to_job_data_processor(not_moved_to_job_df: pd.DataFrame) -> pd.DataFrame:
+def encode_unique_id(df: pd.DataFrame, run_context: RunContext) -> np.ndarray:
     """
-    Process the input DataFrame for candidates who have not moved forward in the job application process.
-
-    Args:
-        not_moved_to_job_df (pandas.DataFrame): The input DataFrame containing data on candidates who have not moved
-        to a new "JOB Title" than the one they had initially stareted with (e.g : Business Research --> Data Analyst)  .
-
-    Returns:
-        pandas.DataFrame: The returned DataFrame contains data on same candidates who don't have the words " Moved to Job " in their process
-    Raises:
-        ValueError: If the input DataFrame is empty or does not contain the required columns.(please check constants.py"
-
+    Returns the integer key of the application of each row : unique_ID = Candidate + new_Job + Nb_of_appl_disq.
+    The application number is registered as a float , to keep the labels of the previous exports (e.g. '_1.0').
     """
-
-    print("######### Moved to Job Position Phase in Progress ... ################# ")
+    components = df[['Candidate', 'new_Job', 'Nb_of_appl_disq']].astype({'Nb_of_appl_disq': float})
+    return run_context.key_registry.encode('unique_ID', components)
 
 
-    # Check if the input DataFrame is empty
-    if not_moved_to_job_df.empty:
-        raise ValueError("The input DataFrame is empty.")
-
-    # Process the DataFrame
-    not_moved_to_job_df = shared_cleaning(initial_input_df=not_moved_to_job_df, key='ID')
-
-    # Drop the temporary column 'ID'
-    #not_moved_to_job_df = not_moved_to_job_df.drop('ID', axis=1)
-
-    # Create the new column 'unique_ID' by combining 'Candidate', 'Job', and 'Nb_of_appl_disqualified'
-    not_moved_to_job_df['unique_ID'] = not_moved_to_job_df[
-                                                    ['Candidate', 'new_Job', 'Nb_of_appl_disq']].apply(lambda x: '_'.join(x.astype(str)), axis=1)
-
-    #not_moved_to_job_df.to_excel(r'./temp/nomovedtojob_beforeID.xlsx')
-    # Further process the dataframe , with the new key = unique_ID
-    not_moved_to_job_df = shared_processing(input_df=not_moved_to_job_df, key='unique_ID')
-    return not_moved_to_job_df
-
-def moved_to_job_data_processor(moved_to_job_df: pd.DataFrame) -> tuple:
+def application_processing(activity_step_report_df: pd.DataFrame, run_context: RunContext) -> pd.DataFrame:
     """
-    This function takes a pandas DataFrame containing data on candidates' job moves and performs several processing steps to generate two modified DataFrames.
-    The first modified DataFrame contains data for candidates whose first activity is a job move.
-    The second modified DataFrame contains data for all other candidates.
+    Numbers the applications of every candidate and computes the per-application features , in a single pass over the
+    activities of all the candidates.
+
+    The candidates fall in three groups , which only differ by the key their applications are counted on and by the
+    job their applications are attached to ('new_Job') :
+        - candidates who have not moved to a new "JOB Title" than the one they had initially started with
+          (e.g : Business Research --> Data Analyst) : counted by ID (Candidate + Job).
+        - candidates whose first activity is their only " Moved to Job " : counted by ID , their " Moved to Job "
+          becomes 'applied with moved to job position'.
+        - candidates with " Moved to Job " in the middle of their process : counted by Candidate , each application is
+          attached to the last job of its activities.
 
     Args:
-        moved_to_job_df: A pandas DataFrame containing data on candidates' job moves.
+        activity_step_report_df: The activities returned by preliminary_processing.
+        run_context: The run context of the current pipeline run.
 
     Returns:
-        A tuple of two pandas DataFrames containing the modified data.
+        pd.DataFrame: The activities with their application key 'unique_ID' and the per-application features.
 
     Raises:
         TypeError: If the input dataframe is not a pandas DataFrame.
         ValueError: If the input dataframe is empty.
     """
-
     # Check input type
-    if not isinstance(moved_to_job_df, pd.DataFrame):
+    if not isinstance(activity_step_report_df, pd.DataFrame):
         raise TypeError("Input dataframe must be a pandas DataFrame.")
 
     # Check if input dataframe is empty
-    if moved_to_job_df.empty:
+    if activity_step_report_df.empty:
         raise ValueError("Input dataframe is empty.")
 
-    # Calculate the number of activities per candidate per activity type
-    moved_to_job_df['activity_count'] = moved_to_job_df.groupby(['Candidate', 'New_Activity'])[
-        'New_Activity'].transform('count')
-
-    # Convert 'Creation time' to datetime if it's not already
-    moved_to_job_df['Creation time'] = pd.to_datetime(moved_to_job_df['Creation time'])
-    # Create a new column 'candidate_first_activity' based on the minimum 'Creation time' for each candidate
-    moved_to_job_df['candidate_first_activity'] = np.where(
-        moved_to_job_df.groupby('Candidate')['Creation time'].transform('min').eq(moved_to_job_df['Creation time']),1, 0)
-
-    # Create a new column called 'is_first_moved_to_job' that indicates whether a row represents a candidate's first 'moved to job position' activity and the count of it is 1
-    moved_to_job_df['is_first_moved_to_job'] = 0
+    print("######### Moved to Job Position Phase in Progress ... ################# ")
 
-    # Use the updated code to identify whether a candidate's first activity is also their first job move and there exist no other MTJP
-    moved_to_job_df.loc[
-        (moved_to_job_df['New_Activity'] == 'moved to job position') & (moved_to_job_df['activity_count'] == 1) & (
-                moved_to_job_df['candidate_first_activity'] == 1),
-        'is_first_moved_to_job'] = moved_to_job_df.groupby('Candidate')['New_Activity'].transform(
-        lambda x: 1 if 'moved to job position' in x.values else 0)
+    total_rows_from_source = run_context.total_rows_from_source
+    df = activity_step_report_df.copy()
 
+    # Convert 'Creation time' to datetime if it's not already
+    df['Creation time'] = normalize_timestamps(df['Creation time'])
 
-    # Filter for candidates where the first activity is 'moved to job position' and the count of it is 1
-    moved_to_job_first_line_only_df = moved_to_job_df[(moved_to_job_df['New_Activity'] == 'moved to job position') &
-                                                 (moved_to_job_df['activity_count'] == 1) &
-                                                 (moved_to_job_df['candidate_first_activity'] == 1) &
-                                                 (moved_to_job_df['is_first_moved_to_job'] == 1)]
+    # Candidates whose first activity is their only 'moved to job position' ( the candidate's first activity is the
+    # one with the minimum 'Creation time' )
+    candidates = df['Candidate_key']
+    moved_to_job = (df['New_Activity'] == 'moved to job position').to_numpy()
+    first_activity = df['Creation time'].eq(df.groupby('Candidate_key')['Creation time'].transform('min')).to_numpy()
+    nb_moved_to_job = pd.Series(moved_to_job).groupby(candidates.to_numpy()).transform('sum').to_numpy()
+    first_only = pd.Series(moved_to_job & first_activity & (nb_moved_to_job == 1)).groupby(
+        candidates.to_numpy()).transform('max').to_numpy()
 
-    # Group by Candidate and get all rows for those candidates
-    moved_to_job_first_only_df = moved_to_job_df[moved_to_job_df['Candidate'].isin(moved_to_job_first_line_only_df['Candidate'])]
+    is_moved = (df['Candidate_movedtojobposition'] == 1).to_numpy()
+    moved_first_only = is_moved & first_only
+    moved_mid = is_moved & ~first_only
 
     # Replace 'moved to job position' with 'Applied with moved to job position'
-    moved_to_job_first_only_df['New_Activity'] = moved_to_job_first_only_df['New_Activity'].replace(
-        'moved to job position', 'applied with moved to job position')
-
-    # Get the rest of the candidates in a separate DataFrame
-    moved_time_activity_report_df = moved_to_job_df[
-        ~moved_to_job_df['Candidate'].isin(moved_to_job_first_only_df['Candidate'])]
-
-    # Drop temp columns before further processing
-    list_col_to_drop = ['is_first_moved_to_job', 'candidate_first_activity', 'activity_count']
-    moved_to_job_first_only_df = moved_to_job_first_only_df.drop(list_col_to_drop, axis=1)
-    moved_time_activity_report_df = moved_time_activity_report_df.drop(list_col_to_drop, axis=1)
-
-    # Pass the subsetted dataframes to processing functions
-    if not moved_to_job_first_only_df.empty:
-        moved_to_job_first_only_df = shared_cleaning(initial_input_df=moved_to_job_first_only_df, key='ID')
-        # create the new col unique_ID = candidate + job + nb_appl
-        moved_to_job_first_only_df['unique_ID'] = moved_to_job_first_only_df[
-            ['Candidate', 'new_Job', 'Nb_of_appl_disq']].apply(lambda x: '_'.join(x.astype(str)), axis=1)
-        print('* Candidates with Moved to Job , First only : ')
-        num_rows_moved_to_job_first_df = len(moved_to_job_first_only_df)
-        percentage_moved_to_job_first_df = (num_rows_moved_to_job_first_df / total_rows_from_source) * 100
-
-        unique_ids_df2 = moved_to_job_first_only_df['unique_ID'].nunique()
-
-        print("* Candidates with Moved to Job position First Only  :")
-        print(f"Number of rows: {num_rows_moved_to_job_first_df}")
-        print(f"Percentage relative to total rows: {percentage_moved_to_job_first_df:.2f}%")
-        print(f"Number of unique application IDs: {unique_ids_df2}")
-
-    if not moved_time_activity_report_df.empty:
-        moved_time_activity_report_df = shared_cleaning(initial_input_df=moved_time_activity_report_df, key='Candidate')
-        moved_time_activity_report_df = moved_time_activity_report_df.sort_values(by=['Candidate', 'new_creation_time'])
-        moved_time_activity_report_df.reset_index(inplace=True)
-        # only for candidates where 'moved to job' appear in the middle of the process , by each candidate , Nb_of_appl_disq , copy the value of the last row of the col Job to all the previous rows
-        moved_time_activity_report_df['new_Job'] = \
-        moved_time_activity_report_df.groupby(['Candidate', 'Nb_of_appl_disq'])['Job'].transform(lambda x: x.iloc[-1])
-        # create the new col unique_ID = candidate + job + nb_appl
-        moved_time_activity_report_df['unique_ID'] = moved_time_activity_report_df[
-            ['Candidate', 'new_Job', 'Nb_of_appl_disq']].apply(lambda x: '_'.join(x.astype(str)), axis=1)
-        # Stats on Moved to Job position Candidates
-        print('Candidates with Moved to Job 1+ : ')
-        num_rows_moved_to_job_df = len(moved_time_activity_report_df)
-        percentage_moved_to_job_df = (num_rows_moved_to_job_df / total_rows_from_source) * 100
-        unique_ids_df1 = moved_time_activity_report_df['unique_ID'].nunique()
-        print(f"Number of rows: {num_rows_moved_to_job_df}")
-        print(f"Percentage relative to total rows: {percentage_moved_to_job_df:.2f}%")
-        print(f"Number of unique application IDs: {unique_ids_df1}")
-
-
-    # Further process the dataframe , with the new key = unique_ID
-    if not moved_time_activity_report_df.empty:
-        #moved_time_activity_report_df.to_excel(r'./temp/movedtojob_not_first__beforeID.xlsx')
-        moved_time_activity_report_df = shared_processing(input_df=moved_time_activity_report_df, key='unique_ID')
-
+    if (moved_first_only & moved_to_job).any():
+        df['New_Activity'] = df['New_Activity'].cat.add_categories(['applied with moved to job position']).mask(
+            moved_first_only & moved_to_job, 'applied with moved to job position')
+
+    # Key the applications are counted on : ID , or the candidate for candidates who moved to job in the middle of
+    # their process ( Job_key -1 )
+    df['Cleaning_key'] = pd.MultiIndex.from_arrays(
+        [df['Candidate_key'], np.where(moved_mid, -1, df['Job_key'])]).factorize()[0]
+    df['moved_mid'] = moved_mid
+    df = shared_cleaning(initial_input_df=df, key='Cleaning_key')
+    moved_mid = df.pop('moved_mid').to_numpy()
+
+    # only for candidates where 'moved to job' appear in the middle of the process , by each candidate , Nb_of_appl_disq ,
+    # copy the value of the last row of the col Job to all the previous rows ( the rows are in time order )
+    # (the Job of the last row even when it is missing , not the last Job given)
+    application_groups = df.groupby(['Cleaning_key', 'Nb_of_appl_disq'], sort=False)
+    group_ids = application_groups.ngroup().to_numpy()
+    last_rows = np.zeros(application_groups.ngroups, dtype=np.int64)
+    np.maximum.at(last_rows, group_ids, np.arange(len(df)))
+    last_job = df['Job'].iloc[last_rows[group_ids]].set_axis(df.index)
+    df['new_Job'] = df['Job'].where(~moved_mid, last_job)
+
+    # create the new col unique_ID = candidate + job + nb_appl
+    df['unique_ID'] = encode_unique_id(df, run_context)
+    df = df.drop(columns='Cleaning_key')
+
+    # Stats on the candidates with Moved to Job position
+    first_only_rows = df['Candidate_movedtojobposition'].eq(1).to_numpy() & ~moved_mid
+    for title, rows in [("* Candidates with Moved to Job position First Only  :", first_only_rows),
+                        ("Candidates with Moved to Job 1+ : ", moved_mid)]:
+        print(title)
+        print(f"Number of rows: {rows.sum()}")
+        print(f"Percentage relative to total rows: {rows.sum() / total_rows_from_source * 100:.2f}%")
+        print(f"Number of unique application IDs: {df.loc[rows, 'unique_ID'].nunique()}")
 
     # Further process the dataframe , with the new key = unique_ID
-    if not moved_to_job_first_only_df.empty:
-        #moved_to_job_first_only_df.to_excel(r'./temp/movedtojob_position_first_only__beforeID.xlsx')
-        moved_to_job_first_only_df = shared_processing(input_df=moved_to_job_first_only_df, key='unique_ID')
-
-
-    return moved_to_job_first_only_df , moved_time_activity_report_df
-
-
-
-
-
-
-
+    df = shared_processing(input_df=df, key='unique_ID')
 
+    print("######### Moved to Job Position Phase DONE .  ################# ")
+    return df
@@ -1,7 +1,10 @@
 from typing import List, Union
+import numpy as np
 import pandas as pd
 from constants import OK_MESSAGE,ACTIONS_NOT_IN_RIGHT_ORDER,COLUMNS_TO_DROP_FROM_GOLDEN_SOURCE,OUTPUT_FILE_PATH_TEMPLATE
 from datetime import datetime
+from run_context import RunContext
+from helper_functions import normalize_timestamps, to_vocabulary, merge_vocabulary
 
 class RankingProcessor:
     def __init__(self, ranking_dict_df):
@@ -56,9 +59,93 @@ class RankingProcessor:
             result.append(ranks)
 
         return result
-def ranking_proc_phase(unified_df, ranking_dict , offer_rejection_df , recruiters_df ):
-    unified_df['Process_Step'] = unified_df['Process_Step'].str.lower().str.strip()
-    ranking_dict['Process_Step'] = ranking_dict['Process_Step'].str.lower().str.strip()
+
+
+def resolve_ranking_versions(df: pd.DataFrame, ranking_dict: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the version of the ranking dictionary ('updated') in force for each activity of `df` : the version of its
+    department with the latest valid-from date ('last_update') strictly before its 'new_creation_time'. Versions
+    without a valid-from date apply from the start , activities matching no version get 0.
+
+    The versions of every department are resolved in a single as-of join , so the dictionary can hold any number of
+    versions per department.
+    """
+    versions_df = ranking_dict[['Department_ST', 'updated', 'last_update']].drop_duplicates()
+    if versions_df.duplicated(subset=['Department_ST', 'updated']).any():
+        raise ValueError("ranking_dict_df must have a single 'last_update' per 'Department_ST' and 'updated' version")
+    versions_df = pd.DataFrame({
+        'Department_ST': versions_df['Department_ST'].astype(object),
+        'valid_from': versions_df['last_update'].fillna(pd.Timestamp.min),
+        'updated': versions_df['updated'],
+    }).sort_values(by='valid_from')
+
+    # Activities without a time match no version
+    activities_df = pd.DataFrame({
+        'Department_ST': df['Department_ST'].astype(object).to_numpy(),
+        'valid_from': df['new_creation_time'].fillna(pd.Timestamp.min).to_numpy(),
+        'position': np.arange(len(df)),
+    }).sort_values(by='valid_from', kind='stable')
+
+    resolved_df = pd.merge_asof(activities_df, versions_df, on='valid_from', by='Department_ST',
+                                allow_exact_matches=False)
+    versions = np.zeros(len(df), dtype=np.int64)
+    versions[resolved_df['position'].to_numpy()] = resolved_df['updated'].fillna(0).to_numpy(dtype=np.int64)
+    return versions
+
+
+def add_rank_order_flags(df: pd.DataFrame, application_summary_df: pd.DataFrame):
+    """
+    Checks the rank order of the steps of every application in one pass over the rank differences of consecutive
+    steps , `df` being in application (unique_ID) and time order with a default index. Adds :
+        - 'red_flag' (1 on every row of an application with a step ranked below the one before it , or without a rank)
+          and 'Comments' (ACTIONS_NOT_IN_RIGHT_ORDER , OK_MESSAGE otherwise) ,
+        - 'order_break_position' (number of the first step breaking the order in its application , from 1) and
+          'order_break' (that step with the one before it , e.g. 'offer ==> technical test') , empty when in order ,
+        - 'Id_rejected_offer' : 1 on every row of an application with a 'hired' step which is not hired (see
+          application_summary_df).
+    """
+    unique_id = df['unique_ID'].to_numpy()
+    rank = df['rank'].to_numpy(dtype=float)
+    positions = np.arange(len(df))
+    starts_application = np.ones(len(df), dtype=bool)
+    starts_application[1:] = unique_id[1:] != unique_id[:-1]
+
+    # A step ranked below the previous step of its application , or without a rank
+    previous_rank = np.roll(rank, 1)
+    breaks_order = np.isnan(rank) | (~starts_application & (rank < previous_rank))
+
+    application_flags_df = pd.DataFrame({
+        'red_flag': breaks_order,
+        'has_hired_step': df['Process_Step'].to_numpy() == 'hired',
+    }).groupby(unique_id).transform('max')
+    df['red_flag'] = application_flags_df['red_flag'].astype(int).to_numpy()
+    df['Comments'] = np.where(df['red_flag'] == 1, ACTIONS_NOT_IN_RIGHT_ORDER, OK_MESSAGE)
+
+    # First step breaking the order of each application , with its position and the step before it
+    first_break_rows = np.flatnonzero(breaks_order)
+    first_break_rows = first_break_rows[~pd.Series(unique_id[first_break_rows]).duplicated().to_numpy()]
+    application_start = np.maximum.accumulate(np.where(starts_application, positions, 0))
+    process_step = df['Process_Step'].astype(object).to_numpy()
+    previous_step = np.where(starts_application, '', np.roll(process_step, 1))
+    first_breaks_df = pd.DataFrame({
+        'order_break_position': first_break_rows - application_start[first_break_rows] + 1,
+        'order_break': [f"{previous} ==> {step}" for previous, step in
+                        zip(previous_step[first_break_rows], process_step[first_break_rows])],
+    }, index=unique_id[first_break_rows])
+    df['order_break_position'] = df['unique_ID'].map(first_breaks_df['order_break_position']).astype('Int16')
+    df['order_break'] = df['unique_ID'].map(first_breaks_df['order_break']).fillna('')
+
+    id_is_hired = df['unique_ID'].map(application_summary_df['ID_is_hired'])
+    df['Id_rejected_offer'] = (application_flags_df['has_hired_step'].to_numpy() & (id_is_hired == 0)).astype(int)
+
+
+def ranking_proc_phase(unified_df: pd.DataFrame, run_context: RunContext) -> pd.DataFrame:
+    ranking_dict = run_context.ranking_dict_df
+    offer_rejection_df = run_context.offer_rejection_df
+    recruiters_df = run_context.recruiters_df
+
+    # Normalised per category , the ranking dictionary is already normalised (see VOCABULARY_COLUMNS)
+    unified_df['Process_Step'] = to_vocabulary(unified_df['Process_Step'])
     # Check if the first value of 'Process_Step' column for each 'unique_ID' is not 'Applied'
     first_process_not_applied = unified_df.groupby('unique_ID')['Process_Step'].transform('first') != 'applied'
 
@@ -91,7 +178,7 @@ def ranking_proc_phase(unified_df, ranking_dict , offer_rejection_df , recruiter
 
     # Drop specified columns from the DataFrame
     try:
-        unified_df.drop(COLUMNS_TO_DROP_FROM_GOLDEN_SOURCE, axis=1, inplace=True)
+        unified_df.drop(COLUMNS_TO_DROP_FROM_GOLDEN_SOURCE, axis=1, inplace=True, errors='ignore')
 
     except KeyError as e:
         # Handle KeyError if any of the specified columns are not present in the DataFrame
@@ -112,27 +199,10 @@ def ranking_proc_phase(unified_df, ranking_dict , offer_rejection_df , recruiter
 
 
 
-    # Define the mapping dictionary
-    mapping_dict = {
-        'Business Research': {'date': pd.to_datetime('2022-05-01'), 'format': '%b-%y'},
-        'Data Analytics': {'date': pd.to_datetime('2022-10-01'), 'format': '%b-%y'},
-        'Business Translation': {'date': pd.to_datetime('2023-04-01'), 'format': '%b-%y'},
-        'Graphic Design': {'date': pd.to_datetime('2023-07-01'), 'format': '%b-%y'}
-
-    }
-
-    def get_last_update(row):
-        department = row['Department_ST']  # Get the department value for the row
-        update_date = row['new_creation_time']
-
-        if department in mapping_dict:
-            if update_date > mapping_dict[department]['date']:
-                return 1
-        return 0
-
-    unified_df['new_creation_time'] = pd.to_datetime(unified_df['new_creation_time'])
-    unified_df['updated'] = unified_df.apply(get_last_update, axis=1)
-    golden_source_df = pd.merge(unified_df, ranking_dict, on=['Department_ST', 'Process_Step','updated' ,'is_senior'], how='left')
+    # Version of the ranking dictionary in force for each activity , from the valid-from dates of the dictionary
+    unified_df['new_creation_time'] = normalize_timestamps(unified_df['new_creation_time'])
+    unified_df['updated'] = resolve_ranking_versions(unified_df, ranking_dict)
+    golden_source_df = merge_vocabulary(unified_df, ranking_dict, on=['Department_ST', 'Process_Step','updated' ,'is_senior'], how='left')
 
     # Fill any null values in the "Process Step" column with an empty string
     golden_source_df.sort_values(by=['unique_ID', 'new_creation_time'], ascending=True, inplace=True)
@@ -143,37 +213,14 @@ def ranking_proc_phase(unified_df, ranking_dict , offer_rejection_df , recruiter
     # Format 'update_date' to month-year
     golden_source_df['last_update'] = golden_source_df['last_update'].dt.strftime('%B-%Y')
 
-    # Create a helper function to check if a series is sorted
-    def check_sorted(s):
-        if s.is_monotonic_increasing:
-            return OK_MESSAGE
-        else:
-            return ACTIONS_NOT_IN_RIGHT_ORDER
-
-    # Apply the function to each group (unique_Id), and assign results to a new column 'Comments'
-    golden_source_df['Comments'] = golden_source_df.groupby('unique_ID')['rank'].transform(check_sorted)
     print (' ################################# RANKING PROC in PROGRESS ####################################################')
-
-    # Create a helper function for the 'red_flag' column
-    def flag_sorted(s):
-        if s.is_monotonic_increasing:
-            return 0
-        else:
-            return 1
-
-    # Apply the function to each group (unique_Id), and assign results to a new column 'red_flag'
-    golden_source_df['red_flag'] = golden_source_df.groupby('unique_ID')['rank'].transform(flag_sorted)
+    # 'red_flag' / 'Comments' for the applications whose steps are out of the rank order , with the first step
+    # breaking the order , and 'Id_rejected_offer' for the applications hired then not hired anymore
+    add_rank_order_flags(golden_source_df, run_context.application_summary_df)
     print(
         ' ################################# RANKING COMPLETED SUCCESFULLY ####################################################')
 
     print('############################# OFFER REJECTION + RECRUITERS MAPPING IN PROGRESS ####################################')
-    # Set 'Id_rejected_offer' to 1 for these rows only if 'ID_is_hired' is 0
-    # Add a new column 'Id_rejected_offer'
-    golden_source_df['Id_rejected_offer'] = 0  # Initialize with 0 for all rows
-
-    golden_source_df.loc[
-        (golden_source_df.groupby('unique_ID')['Process_Step'].transform(lambda x: x.eq('hired').any()))
-        & (golden_source_df['ID_is_hired'] == 0), 'Id_rejected_offer'] = 1
 
     golden_source_df = pd.merge(golden_source_df, offer_rejection_df, on=['Candidate'], how='left')
     golden_source_df = pd.merge(golden_source_df, recruiters_df, on=['new_Job'], how='left')
@@ -0,0 +1,160 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from constants import *
+from helper_functions import (read_file, read_activity_reports, validate_dataframe, get_cache_stats, merge_cache_stats,
+                              KeyRegistry, normalize_vocabulary)
+
+
+class RunContext:
+    """
+    Holds every input loaded for a single pipeline run, together with the number of rows read from the source
+    activity report.
+
+    The context is built once by the entry point (main.py) and handed to each processing stage, so the input files
+    are read exactly once per run and importing any module of the project does not touch the disk.
+    """
+
+    def __init__(self,
+                 activity_report_df: pd.DataFrame,
+                 activity_dict_df: pd.DataFrame,
+                 hr_names_df: pd.DataFrame,
+                 process_step_df: pd.DataFrame,
+                 targets_df: pd.DataFrame,
+                 ranking_dict_df: pd.DataFrame,
+                 is_senior_df: pd.DataFrame,
+                 offer_rejection_df: pd.DataFrame,
+                 recruiters_df: pd.DataFrame,
+                 jobs_dict_df: pd.DataFrame = None):
+        self.activity_report_df = activity_report_df
+        self.activity_dict_df = activity_dict_df
+        self.hr_names_df = hr_names_df
+        self.process_step_df = process_step_df
+        self.targets_df = targets_df
+        self.ranking_dict_df = ranking_dict_df
+        self.is_senior_df = is_senior_df
+        self.offer_rejection_df = offer_rejection_df
+        self.recruiters_df = recruiters_df
+        # Optional : the job titles are only validated against it when it is loaded
+        self.jobs_dict_df = jobs_dict_df
+
+        # Validate input
+        for name, df in self.inputs().items():
+            if name in OPTIONAL_INPUTS and df is None:
+                continue
+            if not isinstance(df, pd.DataFrame):
+                raise TypeError(f"{name} must be a pandas DataFrame")
+
+        # Normalise the low-cardinality text columns of the dictionaries once (see VOCABULARY_COLUMNS)
+        for name, columns in VOCABULARY_COLUMNS.items():
+            setattr(self, name, normalize_vocabulary(getattr(self, name), columns))
+
+        # Total rows from source , used as the reference for every stage report
+        self.total_rows_from_source = len(activity_report_df)
+        # Metrics reported by the stages of the run (e.g. load time per input file) , keyed by stage name
+        self.stage_metrics = {}
+        # Integer keys of the candidates , jobs and applications of the run , with their lookup tables
+        self.key_registry = KeyRegistry()
+        # One row per application (unique_ID) , built by the process step stage
+        self.application_summary_df = None
+
+    def inputs(self) -> dict:
+        """
+        Returns the loaded input DataFrames keyed by their attribute name.
+        """
+        return {
+            'activity_report_df': self.activity_report_df,
+            'activity_dict_df': self.activity_dict_df,
+            'hr_names_df': self.hr_names_df,
+            'process_step_df': self.process_step_df,
+            'targets_df': self.targets_df,
+            'ranking_dict_df': self.ranking_dict_df,
+            'is_senior_df': self.is_senior_df,
+            'offer_rejection_df': self.offer_rejection_df,
+            'recruiters_df': self.recruiters_df,
+            'jobs_dict_df': self.jobs_dict_df,
+        }
+
+
+# Inputs of a run : attribute name , file path , reader , required columns (None : no column check) and the message
+# printed when the file is missing (None : print the exception)
+INPUT_SPECS = [
+    ('activity_report_df', ACTIVITY_REPORT_PATH, read_activity_reports, ACTIVITY_REPORT_COLS,
+     ERROR_ACTIVITY_REPORT_NOT_FOUND),
+    ('activity_dict_df', ACTIVITY_DICT_PATH, read_file, ACTIVITY_DICTIONARY_COLS, ERROR_ACTIVITY_DICT_NOT_FOUND),
+    ('hr_names_df', HR_NAMES_PATH, read_file, HR_NAMES_COLS, ERROR_HR_NAMES_NOT_FOUND),
+    ('process_step_df', PROCESS_STEP_PATH, read_file, PROCESS_STEP_COLS, ERROR_PROCESS_STEP_NOT_FOUND),
+    ('targets_df', TARGETS_STEP_PATH, read_file, TARGETS_COLS, ERROR_TARGETS_FILE_NOT_FOUND),
+    ('ranking_dict_df', RANKING_DICT_PATH, read_file, None, ERROR_RANKING_DICT_NOT_FOUND),
+    ('is_senior_df', IS_SENIOR_DICT_PATH, read_file, None, None),
+    ('offer_rejection_df', OFFER_REJECTION_PATH, read_file, None, None),
+    ('recruiters_df', RECRUITERS_PATH, read_file, None, None),
+    ('jobs_dict_df', JOB_TO_KEEP_DICT, read_file, JOBS_DICT_COLS, WARNING_JOBS_DICT_NOT_FOUND),
+]
+# Inputs the run can do without : a missing file only prints its message
+OPTIONAL_INPUTS = ['jobs_dict_df']
+
+
+def _load_input(file_path: str, reader) -> tuple:
+    # Runs in a worker process : returns the DataFrame , the load time and the cache counters of the worker
+    cache_stats_before = get_cache_stats()
+    start = time.perf_counter()
+    df = reader(file_path)
+    elapsed = time.perf_counter() - start
+    cache_stats = {event: count - cache_stats_before[event] for event, count in get_cache_stats().items()}
+    return df, elapsed, cache_stats
+
+
+def load_run_context(input_specs: list = None, max_workers: int = None):
+    """
+    Loads all the inputs of a run concurrently in a process pool and builds the RunContext.
+
+    Each input is validated once loaded. Missing files are reported with their ERROR_*_NOT_FOUND message (a missing
+    optional input , see OPTIONAL_INPUTS , is left to None) and the load time of every file is printed and kept in
+    `stage_metrics['load']`.
+
+    Returns:
+        RunContext: The context of the run , or None if an input could not be loaded or failed validation.
+    """
+    input_specs = INPUT_SPECS if input_specs is None else input_specs
+    max_workers = max_workers or min(len(input_specs), os.cpu_count() or 1)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(_load_input, file_path, reader)
+                   for name, file_path, reader, _, _ in input_specs}
+
+        inputs, load_times, load_ok = {}, {}, True
+        for name, file_path, _, required_cols, not_found_message in input_specs:
+            try:
+                df, load_times[name], cache_stats = futures[name].result()
+            except FileNotFoundError as e:
+                print(not_found_message or e)
+                load_ok = load_ok and name in OPTIONAL_INPUTS
+                continue
+            except ValueError as e:
+                print(e)
+                load_ok = False
+                continue
+
+            merge_cache_stats(cache_stats)
+            # Validate if the dataframe has all the required columns , and it's not empty
+            if required_cols is not None and not validate_dataframe(df, required_cols):
+                load_ok = False
+                continue
+            inputs[name] = df
+    wall_time = time.perf_counter() - start
+
+    if not load_ok:
+        return None
+
+    for name, elapsed in load_times.items():
+        print(f" - {name} : {len(inputs[name])} rows loaded in {elapsed:.2f}s")
+    print(f" - Load phase : {wall_time:.2f}s wall-clock ({sum(load_times.values()):.2f}s summed over the files)")
+
+    run_context = RunContext(**inputs)
+    run_context.stage_metrics['load'] = load_times
+    return run_context
@@ -0,0 +1,303 @@
+import os
+import sys
+import glob
+import pickle
+import hashlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from constants import *
+from helper_functions import (PARQUET_AVAILABLE, file_content_hash, dataframe_hash, memory_report,
+                              parquet_unsafe_columns)
+from processing_toolkit import preliminary_processing, application_processing
+from Toolkit import final_processing, process_step_stage
+from ranking_processor import ranking_proc_phase
+from run_context import RunContext
+
+
+def _preliminary_stage(_, run_context: RunContext) -> pd.DataFrame:
+    return preliminary_processing(run_context)
+
+
+def _application_stage(activity_step_report_df: pd.DataFrame, run_context: RunContext) -> pd.DataFrame:
+    # Candidates who moved to job position and those who did not only differ by the key of their applications
+    golden_source_df = application_processing(activity_step_report_df, run_context)
+
+    total_rows_from_source = run_context.total_rows_from_source
+    concat_rows = len(golden_source_df)
+    print(
+        f" - Total rows with After before final processing   : {concat_rows} ({concat_rows / total_rows_from_source * 100:.2f}%)")
+    print(f" - Total rows dropped in this step: {total_rows_from_source - concat_rows}")
+    return golden_source_df
+
+
+def _final_stage(golden_source_df: pd.DataFrame, run_context: RunContext) -> pd.DataFrame:
+    unified_df = final_processing(golden_source_df, run_context)
+
+    total_rows_from_source = run_context.total_rows_from_source
+    final_proc_rows = len(unified_df)
+    print(
+        f" - Total rows with After after final processing   : {final_proc_rows} ({final_proc_rows / total_rows_from_source * 100:.2f}%)")
+    print(f" - Total rows dropped in this step: {total_rows_from_source - final_proc_rows}")
+    return unified_df
+
+
+def _process_step_stage(unified_df: pd.DataFrame, run_context: RunContext) -> pd.DataFrame:
+    print("######### PROCESS STEP MAPPING Phase in Progress ....  ################# ")
+    golden_source_df = process_step_stage(unified_df, run_context)
+
+    total_rows_from_source = run_context.total_rows_from_source
+    process_done_rows = len(golden_source_df)
+    print(
+        f" - Total rows After Process step stage   : {process_done_rows} ({process_done_rows / total_rows_from_source * 100:.2f}%)")
+    print(f" - Total rows dropped/added in this step: {process_done_rows - total_rows_from_source}")
+    print("######### PROCESS STEP MAPPING Phase Done .  ################# ")
+    return golden_source_df
+
+
+def _ranking_stage(golden_source_df: pd.DataFrame, run_context: RunContext) -> pd.DataFrame:
+    golden_source_df_with_ranking = ranking_proc_phase(golden_source_df, run_context)
+
+    total_rows_from_source = run_context.total_rows_from_source
+    golden_source_rows = len(golden_source_df_with_ranking)
+    print(
+        f" - Total rows after Golden source   : {golden_source_rows} ({golden_source_rows / total_rows_from_source * 100:.2f}%)")
+    print(f" - Total rows dropped/added in this step: {golden_source_rows - total_rows_from_source}")
+    return golden_source_df_with_ranking
+
+
+def export_outputs(golden_source_df_with_ranking: pd.DataFrame, run_context: RunContext) -> list:
+    """
+    Splits the ranked Golden source into the OK / manual processing / hired outputs and writes them , with the
+    application summary , to Excel in the output folder.
+
+    Returns:
+        list: The paths of the files written.
+    """
+    OK_golden_source_df_with_ranking = golden_source_df_with_ranking[golden_source_df_with_ranking['red_flag'] == 0]
+    Manual_proc_actions_not_in_right_order = golden_source_df_with_ranking[
+        golden_source_df_with_ranking['red_flag'] == 1]
+    application_summary_df = run_context.application_summary_df
+    hired_applications = application_summary_df.index[application_summary_df['ID_is_hired'] == 1]
+    KO_ranking_proc_hired = Manual_proc_actions_not_in_right_order[
+        Manual_proc_actions_not_in_right_order['unique_ID'].isin(hired_applications)].copy()
+    nb_unique_applications = len(Manual_proc_actions_not_in_right_order['unique_ID'].unique())
+    print("- Number of unique applications in KO after ranking processor :", nb_unique_applications)
+    nb_unique_applications_hired = len(KO_ranking_proc_hired['unique_ID'].unique())
+    print(" - Number of unique applications in in KO from ranking processor that been hired :", nb_unique_applications_hired)
+
+    # Concatenate KO_ranking_proc_hired with OK_golden_source_df_with_ranking
+    OK_golden_source_df_with_ranking_updated = pd.concat(
+        [OK_golden_source_df_with_ranking, KO_ranking_proc_hired], ignore_index=True)
+    # Get the unique IDs where 'hired' is present in the 'Process_Step' column
+    hired_unique_ids = Manual_proc_actions_not_in_right_order.loc[
+        Manual_proc_actions_not_in_right_order['Process_Step'] == 'hired', 'unique_ID'].unique()
+
+    # Create a new DataFrame containing all rows for each unique ID where 'hired' is present
+    Hired_in_proc_step_df = Manual_proc_actions_not_in_right_order[
+        Manual_proc_actions_not_in_right_order['unique_ID'].isin(hired_unique_ids)].copy()
+
+    # Concatenate Hired_in_proc_step_df with OK_golden_source_df_with_ranking_updated
+    OK_golden_source_df_with_ranking_updated = pd.concat(
+        [OK_golden_source_df_with_ranking_updated, Hired_in_proc_step_df], ignore_index=True)
+
+    # Create a timestamp using the current date
+    timestamp = datetime.now().strftime("%d-%m")
+    # Define filenames
+    OK_golden_source_df_with_ranking_updated_file_name = fr'.\output_data\OK_golden_source_df_with_ranking_updated-{timestamp}.xlsx'
+    Hired_in_proc_step_df_file_name = fr'.\output_data\Hired_in_proc_step_df-{timestamp}.xlsx'
+    manual_proc_file_name = fr'.\output_data\Manual_proc_actions_not_in_right_order-{timestamp}.xlsx'
+    application_summary_file_name = fr'.\output_data\Application_summary-{timestamp}.xlsx'
+
+    # Replace the integer application keys (unique_ID) by their readable labels before exporting
+    key_registry = run_context.key_registry
+    exports = [
+        (key_registry.materialize(Manual_proc_actions_not_in_right_order), manual_proc_file_name),
+        (key_registry.materialize(OK_golden_source_df_with_ranking_updated),
+         OK_golden_source_df_with_ranking_updated_file_name),
+        (key_registry.materialize(Hired_in_proc_step_df), Hired_in_proc_step_df_file_name),
+        (key_registry.materialize(application_summary_df.reset_index()), application_summary_file_name),
+    ]
+    for df, file_name in exports:
+        df.to_excel(file_name, index=False)
+    return [file_name for _, file_name in exports]
+
+
+# Stages run after the load of the inputs : name , function(output of the previous stage , run context) , inputs of
+# the run context the stage reads (part of its checkpoint key) and the message printed when it fails
+PIPELINE_STAGES = [
+    ('preliminary', _preliminary_stage, ['activity_report_df', 'activity_dict_df', 'hr_names_df'],
+     ERROR_PRELIMINARY_PROCESSING_FAILED),
+    ('application', _application_stage, [], ERROR_SUB_DATAFRAME_CREATION_FAILED),
+    ('final', _final_stage, ['jobs_dict_df'], ERROR_SUB_DATAFRAME_CREATION_FAILED),
+    ('process_step', _process_step_stage, ['process_step_df', 'targets_df', 'is_senior_df'],
+     ERROR_PROCESS_STEP_STAGE_FAILED),
+    ('ranking', _ranking_stage, ['ranking_dict_df', 'offer_rejection_df', 'recruiters_df'],
+     ERROR_RANKING_PROCESSOR_FAILED),
+    ('export', export_outputs, [], ERROR_EXPORT_FAILED),
+]
+# The export writes the outputs , it is never checkpointed
+UNCHECKPOINTED_STAGES = ['export']
+# Every stage of a run , in order , as accepted by the --from / --to options of main.py
+STAGE_NAMES = ['load'] + [name for name, _, _, _ in PIPELINE_STAGES]
+# Modules whose code produces the stage outputs : a change to any of them invalidates every checkpoint
+CODE_MODULES = ['constants', 'helper_functions', 'run_context', 'processing_toolkit', 'Toolkit', 'ranking_processor',
+                'stages']
+
+
+def report_stage_memory(name: str, df: pd.DataFrame, run_context: RunContext, top_columns: int = 5):
+    """
+    Prints the memory used by the output of a stage and its largest columns , and keeps the bytes and dtype of every
+    column in `stage_metrics['memory'][name]` so a column falling back to object dtype shows up between runs.
+    """
+    report_df = memory_report(df)
+    run_context.stage_metrics.setdefault('memory', {})[name] = report_df
+    largest_columns = ' , '.join(f"{column} ({row['dtype']}) {row['bytes'] / 1024 ** 2:.2f} MB"
+                                 for column, row in report_df.head(top_columns).iterrows())
+    print(f"- Memory after the {name} stage : {report_df['bytes'].sum() / 1024 ** 2:.2f} MB in {len(report_df)} "
+          f"columns , largest : {largest_columns}")
+
+
+def stage_keys(run_context: RunContext) -> dict:
+    """
+    Returns the checkpoint key of every stage : a hash chained over the stages , so the key of a stage covers the code ,
+    the inputs it reads and the key of the stage before it. Changing a dictionary invalidates the first stage reading
+    it and every stage after it.
+    """
+    digest = hashlib.sha256()
+    for module_name in CODE_MODULES:
+        digest.update(file_content_hash(sys.modules[module_name].__file__).encode())
+
+    keys = {}
+    inputs = run_context.inputs()
+    for name, _, input_names, _ in PIPELINE_STAGES:
+        digest.update(name.encode())
+        for input_name in input_names:
+            df = inputs[input_name]
+            digest.update((dataframe_hash(df) if df is not None else 'None').encode())
+        keys[name] = digest.hexdigest()[:16]
+        digest = hashlib.sha256(keys[name].encode())
+    return keys
+
+
+def _checkpoint_paths(name: str, key: str) -> tuple:
+    stem = os.path.join(CHECKPOINT_DIR_PATH, f"{name}-{key}")
+    return f"{stem}.parquet", f"{stem}.pkl", f"{stem}.state.pkl"
+
+
+def save_checkpoint(name: str, key: str, df: pd.DataFrame, run_context: RunContext):
+    """
+    Stores the output of a stage in Parquet (pickle when Parquet cannot hold it) with the state of the run context it
+    leaves behind (keys of the run , application summary , stage metrics) , and drops the checkpoints of the stage
+    made for other inputs.
+    """
+    os.makedirs(CHECKPOINT_DIR_PATH, exist_ok=True)
+    parquet_path, pickle_path, state_path = _checkpoint_paths(name, key)
+    try:
+        if not PARQUET_AVAILABLE:
+            raise ValueError("pyarrow is not installed")
+        # Parquet gives back the numbers of an object column as floats , only text object columns are stored as is
+        non_text_columns = parquet_unsafe_columns(df)
+        if non_text_columns:
+            raise ValueError(f"object columns not holding text only : {non_text_columns}")
+        df.to_parquet(parquet_path)
+    except (ValueError, TypeError, ImportError) as e:
+        print(f"- Checkpoint of the {name} stage kept as pickle: {e}")
+        if os.path.exists(parquet_path):
+            os.remove(parquet_path)
+        df.to_pickle(pickle_path)
+
+    state = {
+        'key_lookups': run_context.key_registry.lookups,
+        'application_summary_df': run_context.application_summary_df,
+        'stage_metrics': {stage: metrics for stage, metrics in run_context.stage_metrics.items() if stage != 'load'},
+    }
+    with open(state_path, 'wb') as f:
+        pickle.dump(state, f)
+
+    stale_pattern = glob.escape(name) + '-' + '?' * 16 + '.*'
+    for stale_path in glob.glob(os.path.join(CHECKPOINT_DIR_PATH, stale_pattern)):
+        if stale_path not in (parquet_path, pickle_path, state_path):
+            os.remove(stale_path)
+
+
+def has_checkpoint(name: str, key: str) -> bool:
+    parquet_path, pickle_path, state_path = _checkpoint_paths(name, key)
+    return os.path.exists(state_path) and (os.path.exists(parquet_path) or os.path.exists(pickle_path))
+
+
+def load_checkpoint(name: str, key: str, run_context: RunContext) -> pd.DataFrame:
+    """
+    Returns the checkpointed output of a stage and restores the state of the run context it was saved with.
+    """
+    parquet_path, pickle_path, state_path = _checkpoint_paths(name, key)
+    if os.path.exists(parquet_path):
+        # Parquet gives back None for missing text values , restore NaN as returned by the stages
+        df = pd.read_parquet(parquet_path).fillna(np.nan)
+    else:
+        df = pd.read_pickle(pickle_path)
+
+    with open(state_path, 'rb') as f:
+        state = pickle.load(f)
+    run_context.key_registry.lookups = state['key_lookups']
+    run_context.application_summary_df = state['application_summary_df']
+    run_context.stage_metrics.update(state['stage_metrics'])
+    return df
+
+
+def run_pipeline(run_context: RunContext, start: str = None, stop: str = None, use_checkpoints: bool = True):
+    """
+    Runs the stages of PIPELINE_STAGES on a loaded run context , checkpointing the output of each one.
+
+    Without `start` , the run resumes after the last stage (up to `stop`) whose checkpoint matches the current code and
+    inputs. With `start` , the stages from `start` on are run again from the checkpoint of the stage before it.
+
+    Args:
+        run_context (RunContext): The inputs of the run.
+        start (str): First stage to run (see STAGE_NAMES) , 'load' runs every stage.
+        stop (str): Last stage to run after the load , by default the export.
+        use_checkpoints (bool): False runs every stage without reading or writing checkpoints.
+
+    Returns:
+        The output of the last stage run (the exported file paths for the export) , or None if a stage failed.
+    """
+    stage_names = [name for name, _, _, _ in PIPELINE_STAGES]
+    stop_index = stage_names.index(stop) if stop is not None else len(stage_names) - 1
+    keys = stage_keys(run_context) if use_checkpoints else {}
+
+    if not use_checkpoints or start == 'load':
+        start_index = 0
+    elif start is not None:
+        start_index = stage_names.index(start)
+    else:
+        # Resume after the last checkpointed stage still valid for the current code and inputs
+        start_index = 0
+        for index in range(stop_index, -1, -1):
+            name = stage_names[index]
+            if name not in UNCHECKPOINTED_STAGES and has_checkpoint(name, keys[name]):
+                start_index = index + 1
+                break
+
+    stage_output = None
+    if start_index > 0:
+        previous_stage = stage_names[start_index - 1]
+        if not has_checkpoint(previous_stage, keys[previous_stage]):
+            print(ERROR_CHECKPOINT_NOT_FOUND.format(previous_stage))
+            return None
+        print(f"- Resuming after the {previous_stage} stage from its checkpoint")
+        stage_output = load_checkpoint(previous_stage, keys[previous_stage], run_context)
+
+    for name, stage_function, _, error_message in PIPELINE_STAGES[start_index:stop_index + 1]:
+        try:
+            stage_output = stage_function(stage_output, run_context)
+        except Exception as e:
+            print(error_message.format(str(e)))
+            return None
+        if isinstance(stage_output, pd.DataFrame):
+            report_stage_memory(name, stage_output, run_context)
+        if use_checkpoints and name not in UNCHECKPOINTED_STAGES:
+            save_checkpoint(name, keys[name], stage_output, run_context)
+
+    return stage_output